@@ -1,5 +1,173 @@
 from PIL import Image
+import numpy as np
+import argparse
+import bz2
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import itertools
+import json
+import lzma
 import math
+import multiprocessing.shared_memory
+import os
+import shutil
+import struct
+import sys
+import time
+import tracemalloc
+import zlib
+
+# number of colors that fit in 24 bits
+COLOR_SPACE = 1 << 24
+
+# number of most common colors considered when guessing the base color
+COLOR_COUNT = 30
+
+# confidence for "close colors"
+EPSILON = math.sqrt(3)
+
+# number of rows of pixels held at a time when streaming
+STRIP_HEIGHT = 256
+
+# modes of images write_binary_stream can write to a PPM or PGM file, without any alpha
+STREAM_MODES = ("L", "LA", "RGB", "RGBA", "I;16", "I;16B")
+
+# numbers of last bits of each channel that can hold data
+BITS_PER_CHANNEL = range(1, 5)
+
+# settings tried by decrypt_brute_force: base colors, and bytes decoded to score each attempt
+BRUTE_FORCE_COLORS = 4
+BRUTE_FORCE_SAMPLE = 4096
+
+# framed payloads start with: magic, version, channel flags, payload length, payload CRC-32
+FRAME_MAGIC = b"STEG"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct(">4sBBQI")
+
+# compressed payloads are framed with the next version, and the compression in bits 4-5 of the flags
+COMPRESSED_FRAME_VERSION = 2
+COMPRESSIONS = {"zlib": 1, "lzma": 2, "bz2": 3}
+
+# levels each compression accepts
+COMPRESSION_LEVELS = {"zlib": range(-1, 10), "lzma": range(0, 10), "bz2": range(1, 10)}
+
+# bytes of a payload compressed at a time, and of output decompressed at a time
+COMPRESSION_CHUNK = 1 << 20
+
+# most bytes a compressed payload may decompress to
+MAX_DECOMPRESSED_SIZE = 1 << 28
+
+# payloads spread across several base colors start with: magic, number of base colors
+MULTI_MAGIC = b"STGM"
+MULTI_HEADER = struct.Struct(">4sB")
+
+# starts of common file formats, which make decoded data plausible
+KNOWN_MAGIC = [FRAME_MAGIC, b"\x89PNG", b"\xFF\xD8\xFF", b"GIF8", b"%PDF", b"PK\x03\x04", b"\x1F\x8B"]
+
+# called with the StageTiming of each instrumented stage while profiling, see profile
+stage_listeners = []
+
+# peak memory traced before each running stage started its own, outermost first
+stage_peaks = []
+
+StageTiming = collections.namedtuple("StageTiming", ["stage", "seconds", "pixels", "allocated"])
+
+def stage_pixels(args):
+  """
+  Finds the number of pixels a stage works on from its arguments.
+  :param args: the positional arguments of the stage
+  :return: the pixels of the first image or array of pixels, or None if there is none
+  """
+  for arg in args:
+    if isinstance(arg, Image.Image):
+      return arg.size[0] * arg.size[1]
+    if isinstance(arg, np.ndarray) and arg.ndim >= 2:
+      return arg.shape[0] * arg.shape[1]
+  return None
+
+def instrumented(function):
+  """
+  Reports the time, pixels and memory of each call to a function as a stage, to
+  the listeners added by profile. Without listeners the function is called directly.
+  :param function: the function to instrument, reported under its name
+  :return: the instrumented function
+  """
+  stage = function.__name__
+
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    if not stage_listeners:
+      return function(*args, **kwargs)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+      # keep the peak of the stage running this one before starting a new peak
+      current, peak = tracemalloc.get_traced_memory()
+      if stage_peaks:
+        stage_peaks[-1] = max(stage_peaks[-1], peak)
+      stage_peaks.append(current)
+      tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      seconds = time.perf_counter() - start
+      allocated = None
+      if tracing:
+        peak = max(stage_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if stage_peaks:
+          stage_peaks[-1] = max(stage_peaks[-1], peak)
+        allocated = peak - current
+      timing = StageTiming(stage, seconds, stage_pixels(args), allocated)
+      for listener in list(stage_listeners):
+        listener(timing)
+
+  return wrapper
+
+@contextlib.contextmanager
+def profile(callback=None, allocations=False):
+  """
+  Records every instrumented stage run inside the context.
+  :param callback: called with the StageTiming of each stage as it finishes, if any
+  :param bool allocations: whether to trace the peak memory each stage allocates, which slows it down
+  :return: list of the StageTiming of each stage, in the order they finished
+  """
+  timings = []
+
+  def listener(timing):
+    timings.append(timing)
+    if callback is not None:
+      callback(timing)
+
+  started_tracing = allocations and not tracemalloc.is_tracing()
+  if started_tracing:
+    tracemalloc.start()
+  stage_listeners.append(listener)
+  try:
+    yield timings
+  finally:
+    stage_listeners.remove(listener)
+    if started_tracing:
+      tracemalloc.stop()
+
+def profile_summary(timings):
+  """
+  Totals the timings recorded by profile for each stage.
+  :param [StageTiming] timings: the timings of each stage
+  :return: dict from each stage to its calls, total seconds, total pixels and largest allocation
+  """
+  summary = {}
+  for timing in timings:
+    totals = summary.setdefault(timing.stage, {"calls": 0, "seconds": 0.0, "pixels": 0, "allocated": None})
+    totals["calls"] += 1
+    totals["seconds"] += timing.seconds
+    totals["pixels"] += timing.pixels or 0
+    if timing.allocated is not None:
+      totals["allocated"] = max(totals["allocated"] or 0, timing.allocated)
+  return summary
 
 def compute_distance(color1, color2):
   """
@@ -26,22 +194,7 @@ def find_closest_color(color_dict, color):
   :param (int,int,int) color: The color to find the closest colors for.
   :return: The color tuple for the closest color in the color dictionary.
   """
-  
-  # greater than closest color
-  min = compute_distance((0,0,0),(0xFF, 0xFF, 0xFF)) + 1
-
-  closest_color = (-1, -1, -1)
-
-  for key in color_dict.keys():
-    # calculate distance
-    distance = compute_distance(key, color)
-
-    # check if closest
-    if distance <=  min and distance != 0:
-      min = distance
-      closest_color = key
-
-  return closest_color
+  return ColorIndex.from_dict(color_dict).closest(color)
 
 def get_close_colors(color_dict, color):
   """
@@ -51,22 +204,9 @@ def get_close_colors(color_dict, color):
   :param (int,int,int) color: The color to find the closest colors for.
   :return: The count of colors close to that color.
   """
-  
-  # confidence for "close colors"
-  EPSILON = math.sqrt(3)
-
-  colors = set()
-
-  for key in color_dict.keys():
-    # calculate distance
-    distance = compute_distance(key, color)
-
-    # check if closest
-    if distance <=  EPSILON and distance > 0:
-      colors.add(key)
-
-  return colors
+  return ColorIndex.from_dict(color_dict).close(color)
 
+@instrumented
 def extract_common_colors(color_dict, count):
   """
   Extracts the top count colors from a color dictionary.
@@ -76,26 +216,144 @@ def extract_common_colors(color_dict, count):
   :return: A dictionary of the RGB tuples to their counts, of size count or less.
   """
 
-  top_colors = {}
-  color_dict_copy = color_dict.copy()
+  # nlargest keeps the dictionary order between colors with the same count
+  return dict(heapq.nlargest(max(count, 0), color_dict.items(), key=lambda item: item[1]))
+
+@instrumented
+def top_colors(colors, counts, count):
+  """
+  Extracts the top count colors from the compact form of a color histogram.
+  Colors with the same count keep their order, like extract_common_colors.
+  :param numpy.ndarray colors: The packed colors.
+  :param numpy.ndarray counts: The count of each color.
+  :param int count: The number of colors to extract.
+  :return: numpy arrays of the packed top colors and their counts, most common first
+  """
+  count = min(max(count, 0), counts.size)
+  if count == 0:
+    return colors[:0], counts[:0]
+
+  # only colors at least as common as the count-th most common can be in the top
+  threshold = np.partition(counts, counts.size - count)[counts.size - count]
+  candidates = np.flatnonzero(counts >= threshold)
 
-  found = 0
-  while found < count and found < len(color_dict):
+  # stable sort so ties go to the color that appears first
+  top = candidates[np.argsort(-counts[candidates], kind="stable")][:count]
+  return colors[top], counts[top]
 
-    # Find max value in dictionary thats not in top_Colors
-    max_color = max(color_dict_copy, key=color_dict_copy.get)
-    max_color_val = color_dict_copy[max_color]
+def histogram_to_dict(colors, counts):
+  """
+  Converts the compact form of a color histogram to a color dictionary.
+  :param numpy.ndarray colors: The packed colors.
+  :param numpy.ndarray counts: The count of each color.
+  :return: A dictionary of the RGB tuples to their counts.
+  """
+  return {unpack_color(color): count for color, count in zip(colors.tolist(), counts.tolist())}
 
-    # Add to top_Colors
-    top_colors[max_color] = max_color_val
-    
-    # Remove from temp dict
-    del color_dict_copy[max_color]
+def carrier_pixels(image):
+  """
+  Views the pixels of an image in their own type, without converting them.
+  Grayscale, palette and 16-bit images have a single channel, and palette
+  images are viewed as their palette indices.
+  :param Image image: the image, or an array of its pixels
+  :return: numpy array of shape (height, width, channels)
+  """
+  pixels = np.asarray(image)
+  if pixels.ndim == 2:
+    pixels = pixels[:, :, None]
+  return pixels
 
-    found += 1
-        
-  return top_colors
-  
+def color_channels(pixels):
+  """
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :return: the number of color channels, 1 for grayscale and palette pixels or 3 for RGB
+  """
+  return 1 if pixels.shape[2] <= 2 else 3
+
+def carrier_channels(pixels, red, green, blue, reversed, alpha=False):
+  """
+  Determines the order in which the channels of pixels hold bits, like
+  channel_order. The single channel of grayscale and palette pixels holds a bit
+  if any of red, green or blue do.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :param bool alpha: whether the alpha bit should contain bits, after the colors
+  :return: the channel indices, in the order the bits are written
+  :raises ValueError: if alpha is asked for but the pixels have none
+  """
+  if color_channels(pixels) == 1:
+    channels = [0] if red or green or blue else []
+  else:
+    channels = channel_order(red, green, blue, reversed)
+  if alpha:
+    if pixels.shape[2] not in (2, 4):
+      raise ValueError("The image has no alpha channel")
+    channels.append(pixels.shape[2] - 1)
+  return channels
+
+def pack_colors(pixels):
+  """
+  Packs RGB colors into 24 bit integers, 0xRRGGBB.
+  :param numpy.ndarray pixels: array whose last axis holds the channels of each color
+  :return: array of the packed colors, with the last axis removed
+  """
+  pixels = np.asarray(pixels)
+  colors = pixels[..., 0].astype(np.uint32)
+  colors <<= 8
+  colors |= pixels[..., 1].astype(np.uint32)
+  colors <<= 8
+  colors |= pixels[..., 2].astype(np.uint32)
+  return colors
+
+def unpack_color(color):
+  """
+  Unpacks a 24 bit integer, 0xRRGGBB, into an RGB tuple.
+  :param int color: the packed color
+  :return: the color as (int, int, int)
+  """
+  color = int(color)
+  return (color >> 16, (color >> 8) & 0xFF, color & 0xFF)
+
+@instrumented
+def color_histogram(image):
+  """
+  Counts the colors of an image, in the compact form of packed colors.
+  Colors are ordered by their first appearance reading top to bottom, then
+  left to right, the order in which extract_colors finds them.
+  Grayscale and palette images count their values as gray colors.
+  :param Image image: The image file.
+  :return: numpy arrays of the packed colors and their counts
+  :raises ValueError: if the image has more than 8 bits per channel
+  """
+
+  pixels = carrier_pixels(image)
+  if pixels.dtype != np.uint8:
+    raise ValueError("Only colors of 8-bit images can be counted")
+  if color_channels(pixels) == 1:
+    pixels = pixels[:, :, [0, 0, 0]]
+
+  # packed colors of the pixels, reading each column before the next
+  colors = pack_colors(pixels.transpose(1, 0, 2)).reshape(-1)
+
+  # sorting is cheaper than a table of every possible color for small images
+  if colors.size < COLOR_SPACE // 16:
+    unique_colors, first, counts = np.unique(colors, return_index=True, return_counts=True)
+    order = np.argsort(first, kind="stable")
+    return unique_colors[order], counts[order]
+
+  # count into a table of every possible color, and find where each first appears
+  counts = np.bincount(colors, minlength=COLOR_SPACE)
+  first = np.full(COLOR_SPACE, colors.size, dtype=np.int64)
+  np.minimum.at(first, colors, np.arange(colors.size))
+  unique_colors = np.flatnonzero(counts)
+  order = np.argsort(first[unique_colors], kind="stable")
+  unique_colors = unique_colors[order].astype(np.uint32)
+  return unique_colors, counts[unique_colors]
+
+@instrumented
 def extract_colors(image):
   """
   Extracts the colors from an image file. 
@@ -103,25 +361,139 @@ def extract_colors(image):
   :param Image image: The image file.
   :return: A dictionary of the RGB tuples to their counts.
   """
-  color_dict = {}
-  width, height = image.size
-  pixels = image.load()
-
-  # Iterate over all pixels in image
-  for i in range(width):
-    for j in range(height):
-      rgba = pixels[i,j]
-      rgb = (rgba[0],rgba[1],rgba[2])
+  return histogram_to_dict(*color_histogram(image))
 
-      # If the color is in color_dict, increment the count
-      if rgb in color_dict:
-        color_dict[rgb] = color_dict.get(rgb) + 1
+class ColorIndex:
+  """
+  Index over a list of colors for nearest and close color queries. Color space
+  is split into cubic buckets, so a query only measures the colors in the
+  buckets around it.
+  """
 
-      # else add the color of the pixel
-      else:
-        color_dict[rgb] = 1
+  # each channel is split into 2 ** (8 - BUCKET_BITS) buckets
+  BUCKET_BITS = 4
+  BUCKETS = 1 << (8 - BUCKET_BITS)
+
+  def __init__(self, colors):
+    """
+    Builds the index.
+    :param numpy.ndarray colors: The packed colors, in dictionary order.
+    """
+    self.colors = np.asarray(colors, dtype=np.uint32).reshape(-1)
+    self.sorted_colors = np.sort(self.colors)
+
+    # group the colors by bucket, keeping their order within each bucket
+    channels = self.channels(self.colors) >> self.BUCKET_BITS
+    buckets = (channels[:, 0] * self.BUCKETS + channels[:, 1]) * self.BUCKETS + channels[:, 2]
+    self.order = np.argsort(buckets, kind="stable")
+    self.starts = np.searchsorted(buckets[self.order], np.arange(self.BUCKETS ** 3 + 1))
+
+  @classmethod
+  def from_dict(cls, color_dict):
+    """
+    Builds the index over the colors of a color dictionary.
+    :param {(int,int,int) : int} color_dict: The color dictionary.
+    :return: the ColorIndex
+    """
+    return cls(pack_colors(np.array(list(color_dict.keys()), dtype=np.int64).reshape(-1, 3)))
+
+  @staticmethod
+  def channels(colors):
+    """
+    Unpacks packed colors to their channels.
+    :param numpy.ndarray colors: The packed colors.
+    :return: array of (red, green, blue) rows
+    """
+    colors = np.asarray(colors, dtype=np.int64)
+    return np.stack((colors >> 16, (colors >> 8) & 0xFF, colors & 0xFF), axis=-1)
+
+  def members(self, color, distance):
+    """
+    Finds the colors in the buckets which may be within a distance of a color.
+    :param (int,int,int) color: The color to search around.
+    :param float distance: The distance to search within.
+    :return: the indices of the colors, in no particular order
+    """
+    low = [max(int(math.floor(channel - distance)), 0) >> self.BUCKET_BITS for channel in color[:3]]
+    high = [min(int(math.ceil(channel + distance)), 0xFF) >> self.BUCKET_BITS for channel in color[:3]]
+    if any(l > h for l, h in zip(low, high)):
+      return self.order[:0]
+    red, green, blue = (np.arange(l, h + 1) for l, h in zip(low, high))
+    buckets = ((red[:, None, None] * self.BUCKETS + green[None, :, None]) * self.BUCKETS + blue[None, None, :]).reshape(-1)
+
+    # concatenate the ranges of the buckets
+    starts = self.starts[buckets]
+    lengths = self.starts[buckets + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return self.order[offsets + np.arange(lengths.sum())]
+
+  def distances_squared(self, indices, color):
+    """
+    Computes the squared distances from a color to indexed colors.
+    :param numpy.ndarray indices: The indices of the colors.
+    :param (int,int,int) color: The color to measure from.
+    :return: the squared distances
+    """
+    differences = self.channels(self.colors[indices]) - np.array(color[:3], dtype=np.int64)
+    return (differences * differences).sum(axis=1)
+
+  def closest(self, color):
+    """
+    Finds the closest color to the given color, other than the color itself.
+    Ties go to the last color, like the linear scan did.
+    :param (int,int,int) color: The color to find the closest colors for.
+    :return: The color tuple for the closest color, or (-1, -1, -1) if there is none.
+    """
+
+    # search growing cubes of buckets until nothing outside can be closer
+    for ring in range(self.BUCKETS):
+      indices = self.members(color, ring << self.BUCKET_BITS)
+      distances = self.distances_squared(indices, color)
+      indices, distances = indices[distances != 0], distances[distances != 0]
+      if distances.size and distances.min() < ((ring << self.BUCKET_BITS) + 1) ** 2:
+        break
 
-  return color_dict
+    if distances.size == 0:
+      return (-1, -1, -1)
+    return unpack_color(self.colors[indices[distances == distances.min()].max()])
+
+  def close(self, color, distance=None):
+    """
+    Finds the colors close to the given color, other than the color itself.
+    :param (int,int,int) color: The color to find the closest colors for.
+    :param float distance: The maximum distance, EPSILON by default.
+    :return: The set of close color tuples.
+    """
+    distance = EPSILON if distance is None else distance
+    indices = self.members(color, distance)
+    distances = np.sqrt(self.distances_squared(indices, color))
+    return {unpack_color(close_color) for close_color in self.colors[indices[(distances > 0) & (distances <= distance)]].tolist()}
+
+  def close_counts(self, distance=None):
+    """
+    Counts the colors close to each indexed color, other than the color itself.
+    :param float distance: The maximum distance, EPSILON by default.
+    :return: the count of close colors for each color, in index order
+    """
+    distance = EPSILON if distance is None else distance
+    reach = int(math.floor(distance))
+    steps = np.arange(-reach, reach + 1)
+    offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+    lengths = np.sqrt((offsets * offsets).sum(axis=1))
+    offsets = offsets[(lengths > 0) & (lengths <= distance)]
+
+    # look up every neighbor that stays inside color space
+    counts = np.zeros(self.colors.size, dtype=np.int64)
+    if self.colors.size == 0:
+      return counts
+    channels = self.channels(self.colors)
+    for offset in offsets:
+      neighbors = channels + offset
+      valid = np.all((neighbors >= 0) & (neighbors <= 0xFF), axis=1)
+      neighbors = pack_colors(neighbors[valid])
+      positions = np.minimum(np.searchsorted(self.sorted_colors, neighbors), self.colors.size - 1)
+      counts[valid] += self.sorted_colors[positions] == neighbors
+    return counts
 
 def rotate_image(image, degrees):
   """
@@ -144,65 +516,201 @@ def mirror_image(image):
   # Flip the image from left to right
   return image.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
 
+def bytes_to_bits(bytes):
+  """
+  Unpacks bytes to an array of bits, most significant bit first.
+  :param Bytes bytes: The bytes to unpack
+  :return: the bits as a numpy array of 0s and 1s
+  """
+  return np.unpackbits(np.frombuffer(bytes, dtype=np.uint8))
+
+def bits_to_bytes(bits):
+  """
+  Packs an array of bits to bytes, padding the last byte with 0s.
+  :param numpy.ndarray bits: The bits to pack, as 0s and 1s
+  :return: the bytes that are encoded.
+  """
+  return np.packbits(np.asarray(bits, dtype=np.uint8).reshape(-1)).tobytes()
+
 def bit_string_to_bytes(bits):
   """
   Converts a string of bits to bytes.
   :author: Alec
   :param string bits: The bits to convert
   :return: the bytes that are encoded.
+  :raises ValueError: if the string holds anything but 0s and 1s
   """
-  # pad bit string such that length is divisible by the # of bits in a byte
-  BITS_IN_BYTE = 8
-  bits = bits.ljust(math.ceil(len(bits) / BITS_IN_BYTE) * BITS_IN_BYTE, '0')
-  byte_strings = [bits[i:i+BITS_IN_BYTE] for i in range(0, len(bits), BITS_IN_BYTE)]
+  values = np.frombuffer(bits.encode("ascii"), dtype=np.uint8) - ord("0")
+  if np.any(values > 1):
+    raise ValueError("invalid bit string %r" % bits)
+  return bits_to_bytes(values)
 
-  # convert bit string to bytes, return
-  result = b''
-  for byte_string in byte_strings:
-    result += int(byte_string, 2).to_bytes(1, 'big')
-  return result
-
-def extract_binary(image, BASE_COLOR, red, green, blue, reversed):
+@instrumented
+def extract_binary(image, BASE_COLOR, red, green, blue, reversed, direction_info=(True, True, True), multi=False, alpha=False, bits_per_channel=1):
   """
   Extracts the binary data from an image. The base color is the color in which
   the binary is encoded, and the last bit contains binary data. Reads from left
-  to right, then top to bottom.
+  to right, then top to bottom, unless given another direction.
   :author: Alec
-  :param Image image: The image file.
+  :param Image image: The image file, or pixels mapped by map_carrier.
   :param (int, int, int) BASE_COLOR: The base color containing the data.
   :param bool red: whether red bit should be considered
   :param bool green: whether red bit should be considered
   :param bool blue: whether red bit should be considered
   :param bool reversed: whether rgb should actually be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to read in
+  :param bool multi: whether the data was spread across base colors by write_binary_multi,
+  starting with BASE_COLOR. If so, exactly the payload is returned.
+  :param bool alpha: whether the alpha bit should be considered, after the colors
+  :param int bits_per_channel: the number of last bits of each channel holding data, 1 to 4
   :return: The binary data encoded as a bytes object, padded with 0s at the end.
+  :raises ValueError: if bits_per_channel is not between 1 and 4, or multi is
+  combined with alpha or more than one bit per channel, which write_binary_multi never writes
   """
 
+  check_bits_per_channel(bits_per_channel)
+  if multi:
+    if alpha or bits_per_channel != 1:
+      raise ValueError("data spread across base colors holds one bit of each color channel")
+    return extract_binary_multi(image, BASE_COLOR, red, green, blue, reversed, direction_info)
+
+  # mapped files are read a strip at a time, so only a strip is ever resident
+  if isinstance(image, np.memmap):
+    strips = array_strips(direction_view(image, direction_info))
+    return b"".join(extract_binary_strips(strips, BASE_COLOR, red, green, blue, reversed, alpha=alpha, bits_per_channel=bits_per_channel))
+
   # max distance between encrypted data and the base color
-  CRYPT_DIST = math.sqrt(red + green + blue)
+  pixels = carrier_pixels(image)
+  channels = carrier_channels(pixels, red, green, blue, reversed, alpha)
+  CRYPT_DIST = crypt_distance(len(channels) - alpha, bits_per_channel)
 
-  width, height = image.size
-  pixels = image.load()
-  data = ""
-  
-  # iterate over pixels
-  for y in range(height):
-    for x in range(width):
-      # determine if color is in range
-      if compute_distance(BASE_COLOR, pixels[x, y]) <= CRYPT_DIST:
-        # append r, g, and b bits in that order
-        rgba = pixels[x, y]
-        (r, g, b) = (rgba[0], rgba[1], rgba[2])
-        if not reversed:
-          if red: data += str(r & 1)
-          if green: data += str(g & 1)
-          if blue: data += str(b & 1)
-        else:
-          if blue: data += str(b & 1)
-          if green: data += str(g & 1)
-          if red: data += str(r & 1)
-
-  data_bytes = bit_string_to_bytes(data)
+  # find the pixels in range, in reading order
+  mask = in_range_mask(pixels, BASE_COLOR, CRYPT_DIST)
+  pixel_indices = traversal_indices(mask, direction_info)
+
+  # gather the last bits of the channels, in channel order for each pixel
+  data = gather_bits(pixels, pixel_indices, channels, bits_per_channel)
+
+  data_bytes = bits_to_bytes(data)
   return data_bytes
+
+def gather_bits(pixels, pixel_indices, channels, bits_per_channel=1):
+  """
+  Reads the last bits of the channels of pixels, in channel order, most
+  significant first.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param numpy.ndarray pixel_indices: flat indices of the pixels to read, in order
+  :param [int] channels: the channel indices, in the order the bits are read
+  :param int bits_per_channel: the number of last bits read from each channel
+  :return: numpy array of the bits
+  """
+  pixels = np.asarray(pixels)
+  values = pixels.reshape(-1, pixels.shape[2])[pixel_indices][:, channels]
+  if bits_per_channel == 1:
+    return (values & 1).reshape(-1)
+  shifts = np.arange(bits_per_channel - 1, -1, -1)
+  return ((values[:, :, None] >> shifts) & 1).astype(np.uint8).reshape(-1)
+
+def channel_values(bits, bits_per_channel=1):
+  """
+  Groups bits into the values written to the last bits of each channel, most
+  significant first. The last value is padded with 0s.
+  :param numpy.ndarray bits: the bits, as 0s and 1s
+  :param int bits_per_channel: the number of bits in each value
+  :return: numpy array of the values
+  """
+  if bits_per_channel == 1:
+    return bits
+  padded = np.zeros(-(-len(bits) // bits_per_channel) * bits_per_channel, dtype=np.uint8)
+  padded[:len(bits)] = bits
+  shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+  return (padded.reshape(-1, bits_per_channel) << shifts).sum(axis=1, dtype=np.uint8)
+
+def check_bits_per_channel(bits_per_channel):
+  """
+  Checks that a number of last bits of each channel can hold data.
+  :param int bits_per_channel: the number of last bits of each channel
+  :raises ValueError: if it is not in BITS_PER_CHANNEL
+  """
+  if bits_per_channel not in BITS_PER_CHANNEL:
+    raise ValueError("bits_per_channel must be between %d and %d, not %r" % (BITS_PER_CHANNEL[0], BITS_PER_CHANNEL[-1], bits_per_channel))
+
+def crypt_distance(color_count, bits_per_channel=1):
+  """
+  Finds the max distance between encrypted data and the base color.
+  :param int color_count: the number of color channels holding bits
+  :param int bits_per_channel: the number of last bits of each channel holding bits
+  :return: the distance, as compute_distance measures it
+  """
+  return math.sqrt(color_count) * ((1 << bits_per_channel) - 1)
+
+def extract_binary_strips(strips, BASE_COLOR, red, green, blue, reversed, length=None, alpha=False, bits_per_channel=1):
+  """
+  Extracts binary data from strips of an image as they stream past, like
+  extract_binary reading from left to right, then top to bottom. Bytes are
+  yielded as soon as the strip completing them is read.
+  :param strips: iterable of numpy arrays of shape (rows, width, channels), from top to bottom
+  :param (int, int, int) BASE_COLOR: The base color containing the data.
+  :param bool red: whether red bit should be considered
+  :param bool green: whether green bit should be considered
+  :param bool blue: whether blue bit should be considered
+  :param bool reversed: whether rgb should actually be bgr
+  :param int length: the number of bytes to extract before stopping, or None to read every strip
+  :param bool alpha: whether the alpha bit should be considered, after the colors
+  :param int bits_per_channel: the number of last bits of each channel holding data
+  :return: generator of bytes objects, which joined are the binary data
+  :raises ValueError: if bits_per_channel is not between 1 and 4
+  """
+
+  check_bits_per_channel(bits_per_channel)
+  # bits of an incomplete byte carried over to the next strip
+  pending = np.zeros(0, dtype=np.uint8)
+  remaining = length
+  for strip in strips:
+    # max distance between encrypted data and the base color
+    strip = carrier_pixels(strip)
+    channels = carrier_channels(strip, red, green, blue, reversed, alpha)
+    CRYPT_DIST = crypt_distance(len(channels) - alpha, bits_per_channel)
+    pixel_indices = np.flatnonzero(in_range_mask(strip, BASE_COLOR, CRYPT_DIST))
+    bits = np.concatenate((pending, gather_bits(strip, pixel_indices, channels, bits_per_channel)))
+    whole = len(bits) // 8 * 8
+    if remaining is not None:
+      whole = min(whole, remaining * 8)
+    chunk, pending = bits_to_bytes(bits[:whole]), bits[whole:]
+    if chunk:
+      yield chunk
+    if remaining is not None:
+      remaining -= len(chunk)
+      if remaining == 0:
+        return
+
+  # the last byte is padded with 0s, like extract_binary
+  if len(pending):
+    yield bits_to_bytes(pending)
+
+def extract_binary_stream(image, out_file, BASE_COLOR, red, green, blue, reversed, length=None, strip_height=STRIP_HEIGHT):
+  """
+  Extracts binary data from an image one strip of rows at a time, writing it
+  to a file as it goes. Reads from left to right, then top to bottom.
+  Only arrays, and PPM, PGM and BMP files Pillow has not loaded yet, are read
+  a strip at a time (see image_strips); any other image, such as a PNG, is
+  decoded whole before the first byte is written.
+  :param image: The image file, or a numpy array of pixels such as map_carrier returns.
+  :param out_file: binary file-like object to write the binary data to
+  :param (int, int, int) BASE_COLOR: The base color containing the data.
+  :param bool red: whether red bit should be considered
+  :param bool green: whether green bit should be considered
+  :param bool blue: whether blue bit should be considered
+  :param bool reversed: whether rgb should actually be bgr
+  :param int length: the number of bytes to extract before stopping, or None to read the whole image
+  :param int strip_height: the number of rows in each strip
+  :return: the number of bytes written
+  """
+  written = 0
+  for chunk in extract_binary_strips(image_strips(image, strip_height), BASE_COLOR, red, green, blue, reversed, length):
+    out_file.write(chunk)
+    written += len(chunk)
+  return written
   
 def bytes_to_bit_string(bytes):
   """
@@ -211,81 +719,1079 @@ def bytes_to_bit_string(bytes):
   :param Bytes bytes: The bytes to convert
   :return: the bytes as a bit string
   """
-  data = ""
-  BITS_IN_BYTE = 8
-  for b in bytes:
-    for bit_offset in range(BITS_IN_BYTE -1, -1, -1):
-        bit = (b >> bit_offset) & 1
-        data += str(bit)
-  return data
+  return (bytes_to_bits(bytes) + ord("0")).tobytes().decode("ascii")
+
+def channel_order(red, green, blue, reversed):
+  """
+  Determines the order in which the channels of a pixel hold bits.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :return: the channel indices, in the order the bits are written
+  """
+  channels = [channel for channel, enabled in enumerate((red, green, blue)) if enabled]
+  if reversed:
+    channels.reverse()
+  return channels
 
-def write_binary(image, bytes, BASE_COLOR, red, green, blue, reversed):
+@instrumented
+def write_binary(image, bytes, BASE_COLOR, red, green, blue, reversed, direction_info=(True, True, True), in_place=False, alpha=False, bits_per_channel=1):
   """
   Writes the binary data to an image. The base color is the color in which
   the binary should be encoded, and the last bit should contain binary data. Reads from left
-  to right, then top to bottom.
+  to right, then top to bottom, unless given another direction.
+  By default the image is copied once and left unchanged; in place, the image
+  itself is written. Either way only the channel bytes holding bits change, so
+  alpha is kept unless it holds bits, and the pixels are read a strip at a
+  time, until the bits run out.
+  Grayscale, palette and 16-bit images are written in their own pixel values,
+  so the base color of a palette image is a palette index, as (index, index, index).
+  Arrays of pixels, such as map_carrier returns, are written with write_binary_in_place.
   :author: Alec
-  :param Image image: The image file.
+  :param Image image: The image file, or an array of its pixels.
   :param Bytes bytes: The raw data to write.
   :param (int, int, int) BASE_COLOR: The base color to contain the data.
   :param bool red: whether red bit should contain bits
   :param bool green: whether green bit should contain bits
   :param bool blue: whether blue bit should contain bits
   :param bool reversed: whether rgb should be bgr
-  :return: The updated image.
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to write in
+  :param bool in_place: whether to write into the image itself rather than a copy
+  :param bool alpha: whether the alpha bit should contain bits, after the colors
+  :param int bits_per_channel: the number of last bits of each channel to write, 1 to 4
+  :return: The updated image, which is image itself if in place.
+  :raises ValueError: if bits_per_channel is not between 1 and 4
+  """
+
+  check_bits_per_channel(bits_per_channel)
+  if isinstance(image, np.ndarray):
+    # a copy of a mapped array is an ordinary array in memory
+    if not in_place:
+      image = np.array(image)
+    write_binary_in_place(image, bytes, BASE_COLOR, red, green, blue, reversed, direction_info, bits_per_channel=bits_per_channel, alpha=alpha)
+    return image
+
+  if not in_place:
+    image = image.copy()
+
+  # write a strip of rows in the direction at a time, until the bits run out,
+  # pasting back only the strips holding bits
+  bits = bytes_to_bits(bytes)
+  written = 0
+  for box in direction_boxes(image.size, direction_info):
+    if written == len(bits):
+      break
+    pixels = carrier_pixels(np.array(image.crop(box)))
+    channels = carrier_channels(pixels, red, green, blue, reversed, alpha)
+    count = write_strip(direction_view(pixels, direction_info), bits[written:], BASE_COLOR, channels, bits_per_channel)
+    if count:
+      image.paste(Image.frombytes(image.mode, (pixels.shape[1], pixels.shape[0]), pixels.tobytes()), box)
+      written += count
+  return image
+
+def direction_boxes(size, direction_info, strip_height=STRIP_HEIGHT):
+  """
+  Finds the boxes of an image holding each strip of rows of the image
+  positioned in a specified direction, as direction_view positions it.
+  :param (int, int) size: the width and height of the image
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction info of image
+  :param int strip_height: the number of rows in each strip
+  :return: generator of the (left, top, right, bottom) boxes, in reading order
+  """
+  width, height = size
+  rows = direction_view(np.broadcast_to(np.arange(height)[:, None], (height, width)), direction_info)
+  columns = direction_view(np.broadcast_to(np.arange(width), (height, width)), direction_info)
+  for top in range(0, rows.shape[0], strip_height):
+    # opposite corners of a strip are opposite corners of its box
+    bottom = min(top + strip_height, rows.shape[0]) - 1
+    corner_rows, corner_columns = (rows[top, 0], rows[bottom, -1]), (columns[top, 0], columns[bottom, -1])
+    yield (int(min(corner_columns)), int(min(corner_rows)), int(max(corner_columns)) + 1, int(max(corner_rows)) + 1)
+
+def write_strip(strip, bits, BASE_COLOR, channels, bits_per_channel=1):
   """
+  Writes bits into the base color pixels of a strip in place, reading from left
+  to right, then top to bottom, until the bits or the pixels run out. Only the
+  channel bytes holding bits are read and written.
+  :param numpy.ndarray strip: writable array of shape (rows, width, channels), in any layout
+  :param numpy.ndarray bits: the bits to write, as 0s and 1s
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :param [int] channels: the channel indices, in the order the bits are written
+  :param int bits_per_channel: the number of last bits of each channel to write
+  :return: the number of bits written
+  """
+  if not channels:
+    return 0
+  rows, columns = np.nonzero(base_color_mask(strip, BASE_COLOR))
+  count = min(len(rows) * len(channels) * bits_per_channel, len(bits))
+  data = channel_values(bits[:count], bits_per_channel)
+  rows, columns = rows[:-(-len(data) // len(channels))], columns[:-(-len(data) // len(channels))]
+  values = strip[rows, columns][:, channels].reshape(-1)
+  values[:len(data)] = (values[:len(data)] >> bits_per_channel << bits_per_channel) | data
+  strip[rows[:, None], columns[:, None], channels] = values.reshape(len(rows), len(channels))
+  return count
+
+def base_channels(pixels, BASE_COLOR):
+  """
+  Matches the base color to the color channels of pixels. Grayscale and palette
+  pixels are compared with the first channel of the base color only.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param (int, int, int) BASE_COLOR: The base color.
+  :return: numpy array of the base color's channels to compare with
+  """
+  return np.array(BASE_COLOR[:color_channels(pixels)], dtype=np.int64)
+
+def base_color_mask(pixels, BASE_COLOR):
+  """
+  Finds the pixels that are exactly the base color.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :return: boolean numpy array of shape (height, width)
+  """
+  base = base_channels(pixels, BASE_COLOR)
+  return np.all(pixels[:, :, :len(base)] == base.astype(np.int16 if pixels.dtype == np.uint8 else np.int64), axis=2)
+
+def embed_bits(pixels, pixel_indices, channels, bits, bits_per_channel=1):
+  """
+  Writes bits into the last bits of the channels of pixels, in place. Each pixel
+  takes bits_per_channel bits per channel, in channel order, until the bits run out.
+  :param numpy.ndarray pixels: contiguous array of shape (height, width, channels)
+  :param numpy.ndarray pixel_indices: flat indices of the pixels to write, in order
+  :param [int] channels: the channel indices, in the order the bits are written
+  :param numpy.ndarray bits: the bits to write, as 0s and 1s
+  :param int bits_per_channel: the number of last bits of each channel to write
+  :return: the number of bits written
+  """
+  flat = pixels.reshape(-1)
+  values = channel_values(bits, bits_per_channel)
+  offsets = channel_offsets(pixel_indices, pixels.shape[2], channels)[:len(values)]
+  flat[offsets] = (flat[offsets] >> bits_per_channel << bits_per_channel) | values[:len(offsets)]
+  return min(len(bits), len(offsets) * bits_per_channel)
+
+def channel_offsets(pixel_indices, channel_count, channels):
+  """
+  Finds the offsets of the channel bytes that hold bits in a flattened pixel array.
+  :param numpy.ndarray pixel_indices: flat indices of the pixels, in order
+  :param int channel_count: the number of channels of each pixel
+  :param [int] channels: the channel indices, in the order the bits are written
+  :return: numpy array of the offsets, in write order
+  """
+  channels = np.array(channels, dtype=np.intp)
+  return (pixel_indices[:, None] * channel_count + channels[None, :]).reshape(-1)
+
+class PayloadBits:
+  """
+  Reads the bits of a payload from a file-like object as they are needed, so
+  only the bits not yet written are held in memory.
+  """
+
+  def __init__(self, data_file):
+    """
+    :param data_file: binary file-like object to read the payload from
+    """
+    self.data_file = data_file
+    self.pending = np.zeros(0, dtype=np.uint8)
+    self.exhausted = False
+
+  def take(self, count):
+    """
+    Takes the next bits of the payload.
+    :param int count: the number of bits wanted
+    :return: numpy array of up to count bits, fewer only once the payload runs out
+    """
+    while self.pending.size < count and not self.exhausted:
+      chunk = self.data_file.read((count - self.pending.size + 7) // 8)
+      if not chunk:
+        self.exhausted = True
+      self.pending = np.concatenate((self.pending, bytes_to_bits(chunk)))
+    bits, self.pending = self.pending[:count], self.pending[count:]
+    return bits
+
+def image_strips(image, strip_height=STRIP_HEIGHT):
+  """
+  Splits an image into strips of rows, from top to bottom. Arrays, and PPM, PGM
+  and BMP files Pillow has not loaded yet, are read a strip at a time with
+  file_strips; any other image is decoded whole by Pillow before its first strip.
+  :param Image image: The image file, or an array of its pixels
+  :param int strip_height: the number of rows in each strip
+  :return: generator of numpy arrays of shape (rows, width, channels)
+  """
+  if isinstance(image, np.ndarray):
+    yield from array_strips(carrier_pixels(image), strip_height)
+    return
+  if getattr(image, "tile", None) and image.format in ("PPM", "BMP") and getattr(image, "filename", None):
+    try:
+      strips = file_strips(image.filename, strip_height)
+    except ValueError:
+      strips = None
+    if strips is not None:
+      yield from strips
+      return
 
-  # extract info about image
   width, height = image.size
-  pixels = image.load()
-  
-  # set up data variable to read from bytes
-  data = bytes_to_bit_string(bytes)
-  data_idx = 0
+  for top in range(0, height, strip_height):
+    yield carrier_pixels(image.crop((0, top, width, min(top + strip_height, height))))
 
-  # initialize new image object 
-  new_image = Image.new(image.mode, image.size)
-  
-  # iterate over pixels
-  new_pixels = []
-  for y in range(height):
-    for x in range(width):
-      # determine if color is the base color
-      rgba = pixels[x,y]
-      (r, g, b) = (rgba[0], rgba[1], rgba[2])
-      if BASE_COLOR == (r, g, b):
-        if not reversed:
-          if red and data_idx < len(data):
-            r &= ~1
-            r |= data[data_idx] == '1'
-            data_idx += 1
-          if green and data_idx < len(data):
-            g &= ~1
-            g |= data[data_idx] == '1'
-            data_idx += 1
-          if blue and data_idx < len(data):
-            b &= ~1
-            b |= data[data_idx] == '1'
-            data_idx += 1
-        else:
-          if blue and data_idx < len(data):
-            b &= ~1
-            b |= data[data_idx] == '1'
-            data_idx += 1
-          if green and data_idx < len(data):
-            g &= ~1
-            g |= data[data_idx] == '1'
-            data_idx += 1
-          if red and data_idx < len(data):
-            r &= ~1
-            r |= data[data_idx] == '1'
-            data_idx += 1
-
-        pixels[x,y] = (r,g,b)
-      new_pixels.append((r,g,b))
-  
-  new_image.putdata(new_pixels)        
-  return new_image
+def write_binary_strips(strips, data_file, BASE_COLOR, red, green, blue, reversed):
+  """
+  Writes binary data into strips of an image as they stream past, like
+  write_binary reading from left to right, then top to bottom. The payload is
+  read from a file only as fast as the strips can hold it.
+  :param strips: iterable of numpy arrays of shape (rows, width, channels), from top to bottom
+  :param data_file: binary file-like object to read the raw data from
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :return: generator of the updated strips
+  """
+  payload = PayloadBits(data_file)
+  for strip in strips:
+    pixels = np.array(carrier_pixels(strip))
+    channels = carrier_channels(pixels, red, green, blue, reversed)
+    if channels and not payload.exhausted:
+      # only the pixels up to the last bit of the payload are written
+      pixel_indices = np.flatnonzero(base_color_mask(pixels, BASE_COLOR))
+      bits = payload.take(len(pixel_indices) * len(channels))
+      embed_bits(pixels, pixel_indices[:-(-len(bits) // len(channels))], channels, bits)
+    yield pixels
+
+def write_binary_strips_directed(strip_source, data, BASE_COLOR, red, green, blue, reversed, direction_info):
+  """
+  Writes binary data into strips of an image as they stream past, like
+  write_binary in any direction. A first pass over the strips counts the base
+  color pixels of each row or column, so the place of every pixel in the
+  reading order is known as its strip passes.
+  :param strip_source: function returning a new iterable of the strips, from top to bottom
+  :param Bytes data: The raw data to write.
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to write in
+  :return: generator of the updated strips
+  """
+  horiz_first, top_to_bottom, left_to_right = direction_info
+
+  # base color pixels of each row, or of each column, in image order
+  lines = None
+  for strip in strip_source():
+    mask = base_color_mask(carrier_pixels(strip), BASE_COLOR)
+    if horiz_first:
+      lines = mask.sum(axis=1) if lines is None else np.concatenate((lines, mask.sum(axis=1)))
+    else:
+      lines = mask.sum(axis=0) if lines is None else lines + mask.sum(axis=0)
+  if lines is None:
+    return
+
+  # place in the reading order of the first base color pixel of each line. Like
+  # traversal_indices, columns are read in order if top_to_bottom, and down if left_to_right
+  forward = top_to_bottom
+  ordered = lines if forward else lines[::-1]
+  starts = np.concatenate(([0], np.cumsum(ordered)[:-1]))
+  starts = starts if forward else starts[::-1]
+
+  payload = np.frombuffer(data, dtype=np.uint8)
+  above = np.zeros_like(lines)
+  top = 0
+  for strip in strip_source():
+    pixels = np.array(carrier_pixels(strip))
+    channels = np.array(carrier_channels(pixels, red, green, blue, reversed), dtype=np.intp)
+    mask = base_color_mask(pixels, BASE_COLOR)
+    rows, columns = np.nonzero(mask)
+
+    # place of each base color pixel in the reading order
+    if horiz_first:
+      inclusive = np.cumsum(mask, axis=1, dtype=np.int32)[rows, columns]
+      within = inclusive - 1 if left_to_right else lines[top + rows] - inclusive
+      ranks = starts[top + rows] + within
+    else:
+      inclusive = np.cumsum(mask, axis=0, dtype=np.int32)[rows, columns] + above[columns]
+      within = inclusive - 1 if left_to_right else lines[columns] - inclusive
+      ranks = starts[columns] + within
+      above += mask.sum(axis=0)
+    top += pixels.shape[0]
+
+    # the bit of each channel of each pixel, where the payload reaches it
+    reached = ranks * len(channels) < len(payload) * 8
+    rows, columns, ranks = rows[reached], columns[reached], ranks[reached]
+    positions = ranks[:, None] * len(channels) + np.arange(len(channels))
+    present = positions < len(payload) * 8
+    bits = np.zeros(positions.shape, dtype=np.uint8)
+    bits[present] = (payload[positions[present] >> 3] >> (7 - (positions[present] & 7))) & 1
+    values = pixels[rows[:, None], columns[:, None], channels]
+    pixels[rows[:, None], columns[:, None], channels] = np.where(present, (values >> 1 << 1) | bits, values)
+    yield pixels
+
+def write_ppm(out_file, size, strips):
+  """
+  Writes strips of an image to a binary PPM file as they stream past, keeping
+  only the color channels. Grayscale strips are written to a PGM file instead,
+  and 16-bit strips with big-endian samples.
+  :param out_file: binary file-like object to write to
+  :param (int, int) size: the width and height of the image
+  :param strips: iterable of numpy arrays of shape (rows, width, channels), from top to bottom
+  :raises ValueError: if the samples are not 8 or 16-bit unsigned integers
+  """
+  header = None
+  for strip in strips:
+    if strip.dtype not in (np.uint8, np.uint16):
+      raise ValueError("Only 8 or 16-bit samples can be written to a PPM file")
+    if header is None:
+      header = b"P5" if color_channels(strip) == 1 else b"P6"
+      out_file.write(header + b"\n%d %d\n%d\n" % (size + (np.iinfo(strip.dtype).max,)))
+    out_file.write(strip[:, :, :color_channels(strip)].astype(strip.dtype.newbyteorder(">")).tobytes())
+  if header is None:
+    out_file.write(b"P6\n%d %d\n255\n" % size)
+
+def write_binary_stream(image, data_file, out_file, BASE_COLOR, red, green, blue, reversed, strip_height=STRIP_HEIGHT, direction_info=(True, True, True)):
+  """
+  Writes binary data read from a file into an image one strip of rows at a
+  time, writing the updated image to a PPM file as it goes. Reading from left
+  to right, then top to bottom, the payload is read only as the strips take it,
+  so memory is bounded by the strip size. Any other direction reads the strips
+  twice and holds the payload, so memory is bounded by the strip and payload
+  sizes. Only arrays and unloaded PPM, PGM and BMP files are read a strip at a
+  time; other images are decoded whole first, see image_strips.
+  :param Image image: The image file, or an array of its pixels.
+  :param data_file: binary file-like object to read the raw data from
+  :param out_file: binary file-like object to write the PPM image to
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :param int strip_height: the number of rows in each strip
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to write in
+  :raises ValueError: if the image is not in one of STREAM_MODES, such as a palette image, whose palette a PPM file cannot hold
+  """
+  if isinstance(image, Image.Image) and image.mode not in STREAM_MODES:
+    raise ValueError("%s images cannot be written to a PPM file" % image.mode)
+  if tuple(direction_info) == (True, True, True):
+    strips = write_binary_strips(image_strips(image, strip_height), data_file, BASE_COLOR, red, green, blue, reversed)
+  else:
+    source = functools.partial(image_strips, image, strip_height)
+    strips = write_binary_strips_directed(source, data_file.read(), BASE_COLOR, red, green, blue, reversed, direction_info)
+  size = image.size if isinstance(image, Image.Image) else (image.shape[1], image.shape[0])
+  write_ppm(out_file, size, strips)
+
+def array_strips(pixels, strip_height=STRIP_HEIGHT):
+  """
+  Splits a pixel array into strips of rows, from top to bottom, without copying.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param int strip_height: the number of rows in each strip
+  :return: generator of views of shape (rows, width, channels)
+  """
+  for top in range(0, pixels.shape[0], strip_height):
+    yield pixels[top:top + strip_height]
+
+def pnm_header(header):
+  """
+  Parses the header of a binary PPM or PGM file.
+  :param bytes header: the start of the file, holding at least the whole header
+  :return: the width, height, number of channels and offset of the pixel data
+  :raises ValueError: if the header is malformed or the samples are wider than a byte
+  """
+  values = []
+  position = 2
+  while len(values) < 3:
+    while position < len(header) and header[position:position + 1].isspace():
+      position += 1
+    if header[position:position + 1] == b"#":
+      position = header.find(b"\n", position)
+      if position < 0:
+        raise ValueError("Unterminated comment in header")
+      continue
+    end = position
+    while end < len(header) and header[end:end + 1].isdigit():
+      end += 1
+    if end == position or end == len(header):
+      raise ValueError("Malformed header")
+    values.append(int(header[position:end]))
+    position = end
+
+  width, height, maxval = values
+  if maxval > 255:
+    raise ValueError("Only 8-bit samples can be mapped")
+  # a single whitespace character separates the header from the pixels
+  return width, height, 3 if header[:2] == b"P6" else 1, position + 1
+
+def bmp_header(header):
+  """
+  Parses the header of an uncompressed 24 or 32-bit BMP file.
+  :param bytes header: the start of the file, holding at least the first 34 bytes
+  :return: the width, height (negative if stored top to bottom), bytes per pixel, and offset of the pixel data
+  :raises ValueError: if the bitmap is compressed or not 24 or 32-bit
+  """
+  (offset,) = struct.unpack_from("<I", header, 10)
+  width, height, _, bits, compression = struct.unpack_from("<iiHHI", header, 18)
+  if compression != 0 or bits not in (24, 32):
+    raise ValueError("Only uncompressed 24 or 32-bit bitmaps can be mapped")
+  return width, height, bits // 8, offset
+
+CarrierLayout = collections.namedtuple("CarrierLayout", ["width", "height", "channels", "offset", "stride", "bottom_up", "bgr"])
+
+def carrier_layout(header):
+  """
+  Finds where the pixels of an uncompressed PPM, PGM or BMP file are stored.
+  :param bytes header: the start of the file, holding at least the whole header
+  :return: the CarrierLayout of the width, height, channels, offset of the first row, bytes
+  in each row, whether rows are stored bottom to top, and whether channels are stored BGR
+  :raises ValueError: if the file is not a format whose pixels can be read in place
+  """
+  if header[:2] in (b"P5", b"P6"):
+    width, height, channels, offset = pnm_header(header)
+    return CarrierLayout(width, height, channels, offset, width * channels, False, False)
+
+  if header[:2] == b"BM":
+    width, height, channels, offset = bmp_header(header)
+    # rows are padded to 4 bytes, and stored bottom to top unless the height is negative
+    stride = (width * channels + 3) // 4 * 4
+    return CarrierLayout(width, abs(height), channels, offset, stride, height > 0, True)
+
+  raise ValueError("Only PPM, PGM and BMP files, or raw dumps with a shape, can be mapped")
+
+def layout_pixels(rows, layout):
+  """
+  Views rows of a carrier file as pixels, top to bottom in RGB order, without
+  the alpha of bitmaps.
+  :param numpy.ndarray rows: array of shape (rows, stride) of the stored rows, in stored order
+  :param CarrierLayout layout: the layout of the file, from carrier_layout
+  :return: view of shape (rows, width, channels)
+  """
+  pixels = rows[:, :layout.width * layout.channels].reshape(rows.shape[0], layout.width, layout.channels)
+  if layout.bottom_up:
+    pixels = pixels[::-1]
+  if layout.bgr:
+    pixels = pixels[:, :, 2::-1]
+  return pixels
+
+def map_carrier(path, mode="r", shape=None, offset=0):
+  """
+  Maps the pixels of an uncompressed carrier file into memory without reading
+  them, as an array that the functions reading an image accept, and that
+  write_binary, write_binary_multi and encrypt write to a copy of in memory. Binary PPM
+  (P6) and PGM (P5) files, uncompressed 24 or 32-bit BMP files, and raw pixel
+  dumps of a given shape can be mapped. Bitmaps are viewed top to bottom in
+  RGB order, without their alpha.
+  :param str path: the carrier file
+  :param str mode: "r" to read, "c" to write to memory only (copy on write), or "r+" to write to the file
+  :param (int, int, int) shape: the height, width and channels of a raw dump, which must be given for one
+  :param int offset: the offset of the pixels in a raw dump
+  :return: numpy memmap of shape (height, width, channels), 1 channel for PGM
+  :raises ValueError: if the file is not a format that can be mapped
+  """
+  if shape is not None:
+    return np.memmap(path, dtype=np.uint8, mode=mode, offset=offset, shape=tuple(shape))
+
+  with open(path, "rb") as file:
+    layout = carrier_layout(file.read(4096))
+  rows = np.memmap(path, dtype=np.uint8, mode=mode, offset=layout.offset, shape=(layout.height, layout.stride))
+  return layout_pixels(rows, layout)
+
+def file_strips(path, strip_height=STRIP_HEIGHT):
+  """
+  Reads an uncompressed PPM, PGM or BMP file a strip of rows at a time, from
+  top to bottom, without mapping or decoding the rest of it.
+  :param str path: the carrier file
+  :param int strip_height: the number of rows in each strip
+  :return: generator of numpy arrays of shape (rows, width, channels), like map_carrier
+  :raises ValueError: if the file is not a format whose pixels can be read in place
+  """
+  file = open(path, "rb")
+  try:
+    layout = carrier_layout(file.read(4096))
+  except ValueError:
+    file.close()
+    raise
+  return layout_strips(file, layout, strip_height)
+
+def layout_strips(file, layout, strip_height):
+  """
+  Reads the strips of file_strips, closing the file once they are read.
+  :param file: the carrier file, open for binary reading
+  :param CarrierLayout layout: the layout of the file, from carrier_layout
+  :param int strip_height: the number of rows in each strip
+  :return: generator of numpy arrays of shape (rows, width, channels)
+  """
+  with file:
+    for top in range(0, layout.height, strip_height):
+      count = min(strip_height, layout.height - top)
+      first = layout.height - top - count if layout.bottom_up else top
+      file.seek(layout.offset + first * layout.stride)
+      rows = np.frombuffer(file.read(count * layout.stride), dtype=np.uint8)
+      if rows.size < count * layout.stride:
+        raise ValueError("Carrier file is truncated")
+      yield layout_pixels(rows.reshape(count, layout.stride), layout)
+
+def write_binary_in_place(pixels, bytes, BASE_COLOR, red, green, blue, reversed, direction_info=(True, True, True), strip_height=STRIP_HEIGHT, bits_per_channel=1, alpha=False):
+  """
+  Writes binary data into a pixel array in place, like write_binary, one strip
+  of rows at a time. Only the channel bytes holding bits are written, so the
+  array can be a view of a mapped file, in any layout.
+  :param numpy.ndarray pixels: writable array of shape (height, width, channels)
+  :param Bytes bytes: The raw data to write.
+  :param (int, int, int) BASE_COLOR: The base color to contain the data.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to write in
+  :param int strip_height: the number of rows written at a time
+  :param int bits_per_channel: the number of last bits of each channel to write
+  :param bool alpha: whether the alpha bit should contain bits, after the colors
+  :return: the number of bits written
+  :raises ValueError: if bits_per_channel is not between 1 and 4
+  """
+  check_bits_per_channel(bits_per_channel)
+  bits = bytes_to_bits(bytes)
+  pixels = carrier_pixels(pixels)
+  channels = carrier_channels(pixels, red, green, blue, reversed, alpha)
+  written = 0
+  for strip in array_strips(direction_view(pixels, direction_info), strip_height):
+    if written == len(bits) or not channels:
+      break
+    written += write_strip(strip, bits[written:], BASE_COLOR, channels, bits_per_channel)
+  return written
+
+def encrypt_mapped(bytes, path, out_path, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False, shape=None, offset=0, bits_per_channel=1, compression=None, level=None):
+  """
+  Encrypts data into an uncompressed carrier file through a memory mapping,
+  like encrypt, so only the pixels written are read into memory.
+  :param Bytes bytes: binary data to be encrypted
+  :param str path: the carrier file, which map_carrier must be able to map
+  :param str out_path: the file to write the encrypted carrier to, or None to encrypt the carrier in place
+  :param bool horiz_first: Encrypt data horizontally or vertically
+  :param bool top_to_bottom: Encrypt data top to bottom or bottom to top
+  :param bool left_to_right: Encrypt data left to right or right to left
+  :param (int, int, int) BASE_COLOR: Base color to encrypt data to
+  :param bool red: whether red should be included or not
+  :param bool green: whether green should be included or not
+  :param bool blue: whether blue should be included or not
+  :param bool reversed: whether rgb should be bgr
+  :param bool framed: whether to frame the data with its length and checksum
+  :param (int, int, int) shape: the height, width and channels of a raw dump
+  :param int offset: the offset of the pixels in a raw dump
+  :param int bits_per_channel: the number of last bits of each channel to encrypt to, 1 to 4
+  :param str compression: "zlib", "lzma" or "bz2" to compress the data first, which frames it, or None
+  :param int level: the compression level, or None for the default of the compression
+  :return: the number of bits written
+  :raises ValueError: if bits_per_channel is not between 1 and 4
+  """
+  # checked before the carrier is copied
+  check_bits_per_channel(bits_per_channel)
+  if framed or compression is not None:
+    bytes = frame_payload(bytes, red, green, blue, reversed, compression, level)
+
+  if out_path is not None:
+    shutil.copyfile(path, out_path)
+    path = out_path
+  pixels = map_carrier(path, "r+", shape, offset)
+  written = write_binary_in_place(pixels, bytes, BASE_COLOR, red, green, blue, reversed, (horiz_first, top_to_bottom, left_to_right), bits_per_channel=bits_per_channel)
+  pixels.flush()
+  return written
+
+def decrypt_mapped(path, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False, shape=None, offset=0, bits_per_channel=1):
+  """
+  Decrypts an uncompressed carrier file through a memory mapping, like decrypt.
+  :param str path: the carrier file, which map_carrier must be able to map
+  :param bool horiz_first: Decrypt data horizontally or vertically
+  :param bool top_to_bottom: Decrypt data top to bottom or bottom to top
+  :param bool left_to_right: Decrypt data left to right or right to left
+  :param (int, int, int) BASE_COLOR: the base color containing the data
+  :param bool red: whether red bit should be considered
+  :param bool green: whether green bit should be considered
+  :param bool blue: whether blue bit should be considered
+  :param bool reversed: whether rgb should be bgr
+  :param bool framed: whether the data was framed by encrypt, in which case only the payload is read
+  :param (int, int, int) shape: the height, width and channels of a raw dump
+  :param int offset: the offset of the pixels in a raw dump
+  :param int bits_per_channel: the number of last bits of each channel holding data, 1 to 4
+  :return: Bytes bytes: decrypted binary data
+  """
+  pixels = map_carrier(path, "r", shape, offset)
+  return decrypt(pixels, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed, bits_per_channel=bits_per_channel)
+
+FrameHeader = collections.namedtuple("FrameHeader", ["version", "red", "green", "blue", "reversed", "length", "crc", "compression"])
+
+def compressor(compression, level=None):
+  """
+  Starts compressing a payload.
+  :param str compression: "zlib", "lzma" or "bz2"
+  :param int level: the compression level, or None for the default of the compression
+  :return: a compressor object, with compress and flush
+  :raises ValueError: if the compression is unknown, or the level is not one it accepts
+  """
+  if compression in COMPRESSION_LEVELS and level is not None and level not in COMPRESSION_LEVELS[compression]:
+    levels = COMPRESSION_LEVELS[compression]
+    raise ValueError("%s compression level must be between %d and %d, not %r" % (compression, levels[0], levels[-1], level))
+  if compression == "zlib":
+    return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+  if compression == "lzma":
+    return lzma.LZMACompressor(preset=level)
+  if compression == "bz2":
+    return bz2.BZ2Compressor(9 if level is None else level)
+  raise ValueError("unknown compression %r" % compression)
+
+def decompressor(compression):
+  """
+  Starts decompressing a payload.
+  :param str compression: "zlib", "lzma" or "bz2"
+  :return: a decompressor object, with decompress and eof
+  """
+  return {"zlib": zlib.decompressobj, "lzma": lzma.LZMADecompressor, "bz2": bz2.BZ2Decompressor}[compression]()
+
+def decompress_chunks(compression, chunks, max_size=MAX_DECOMPRESSED_SIZE):
+  """
+  Decompresses a payload from a stream of chunks, COMPRESSION_CHUNK bytes of
+  output at a time, so that a payload decompressing to too much is caught
+  before it is held in memory.
+  :param str compression: "zlib", "lzma" or "bz2"
+  :param chunks: iterable of bytes objects, which joined are the compressed payload
+  :param int max_size: the most bytes the payload may decompress to
+  :return: the decompressed payload
+  :raises ValueError: if the payload does not decompress, is truncated, or decompresses to more than max_size bytes
+  """
+  stream = decompressor(compression)
+  payload = bytearray()
+  try:
+    for data in chunks:
+      # zlib leaves the input it has not used in unconsumed_tail, lzma and bz2 keep it
+      while not stream.eof:
+        output = stream.decompress(data, COMPRESSION_CHUNK)
+        payload += output
+        if len(payload) > max_size:
+          raise ValueError("compressed payload decompresses to more than %d bytes" % max_size)
+        data = getattr(stream, "unconsumed_tail", b"")
+        if not data and len(output) < COMPRESSION_CHUNK and getattr(stream, "needs_input", True):
+          break
+  except (zlib.error, lzma.LZMAError, OSError) as error:
+    raise ValueError("framed payload does not decompress: %s" % error)
+  if not stream.eof:
+    raise ValueError("compressed payload is truncated")
+  return bytes(payload)
+
+def payload_chunks(data, chunk_size=COMPRESSION_CHUNK):
+  """
+  Splits a payload into chunks without copying it, or reads it from a file a chunk at a time.
+  :param data: the payload as bytes, or a binary file-like object to read it from
+  :param int chunk_size: the number of bytes in each chunk
+  :return: generator of the chunks
+  """
+  if hasattr(data, "read"):
+    for chunk in iter(lambda: data.read(chunk_size), b""):
+      yield chunk
+  else:
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+      yield view[start:start + chunk_size]
+
+def frame_payload(bytes, red, green, blue, reversed, compression=None, level=None):
+  """
+  Frames a payload with a header recording its length, checksum and the
+  channels it is written to, so it can be read back without trailing data.
+  A compressed payload is compressed a chunk at a time, so only the compressed
+  data is held, and the header records the compression to reverse.
+  :param Bytes bytes: The raw data to frame, or when compressing, a binary file-like object to read it from.
+  :param bool red: whether red bit contains bits
+  :param bool green: whether green bit contains bits
+  :param bool blue: whether blue bit contains bits
+  :param bool reversed: whether rgb is bgr
+  :param str compression: "zlib", "lzma" or "bz2" to compress the data, or None to frame it as it is
+  :param int level: the compression level, or None for the default of the compression
+  :return: the header followed by the data
+  :raises ValueError: if the compression is unknown
+  """
+  flags = red | green << 1 | blue << 2 | reversed << 3
+  if compression is None:
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, len(bytes), zlib.crc32(bytes)) + bytes
+
+  # compress after room for the header, which is filled in once the length and checksum are known
+  stream = compressor(compression, level)
+  framed = bytearray(FRAME_HEADER.size)
+  for chunk in payload_chunks(bytes):
+    framed += stream.compress(chunk)
+  framed += stream.flush()
+  stored = memoryview(framed)[FRAME_HEADER.size:]
+  flags |= COMPRESSIONS[compression] << 4
+  FRAME_HEADER.pack_into(framed, 0, FRAME_MAGIC, COMPRESSED_FRAME_VERSION, flags, len(stored), zlib.crc32(stored))
+  stored.release()
+  return framed
+
+def parse_frame_header(header):
+  """
+  Reads the header written by frame_payload.
+  :param Bytes header: the first FRAME_HEADER.size bytes of the framed data
+  :return: the FrameHeader
+  :raises ValueError: if the bytes are not a header this version can read
+  """
+  if len(header) < FRAME_HEADER.size:
+    raise ValueError("frame header is truncated")
+  magic, version, flags, length, crc = FRAME_HEADER.unpack(bytes(header[:FRAME_HEADER.size]))
+  if magic != FRAME_MAGIC:
+    raise ValueError("no frame header found")
+  if version not in (FRAME_VERSION, COMPRESSED_FRAME_VERSION):
+    raise ValueError("unsupported frame version %d" % version)
+
+  compression = None
+  if version == COMPRESSED_FRAME_VERSION:
+    names = {number: name for name, number in COMPRESSIONS.items()}
+    if flags >> 4 not in names:
+      raise ValueError("unsupported frame compression %d" % (flags >> 4))
+    compression = names[flags >> 4]
+  return FrameHeader(version, bool(flags & 1), bool(flags & 2), bool(flags & 4), bool(flags & 8), length, crc, compression)
+
+def unframe_payload(data, max_size=MAX_DECOMPRESSED_SIZE):
+  """
+  Unframes data framed by frame_payload, checking its length and checksum, and
+  decompressing it if it was compressed.
+  :param Bytes data: the framed data, which may be followed by anything
+  :param int max_size: the most bytes a compressed payload may decompress to
+  :return: the payload, without the header or anything after it
+  :raises ValueError: if the header is missing or the payload is truncated, corrupt or decompresses to too much
+  """
+  return read_frame([data], max_size)[1]
+
+def frame_chunks(header, chunks):
+  """
+  Reads the payload of a frame from a stream of chunks, stopping as soon as it
+  is complete, and checks its length and checksum once it is.
+  :param FrameHeader header: the header of the frame
+  :param chunks: iterator of bytes objects following the header
+  :return: generator of the bytes objects of the payload
+  :raises ValueError: if the payload is truncated or its checksum does not match
+  """
+  remaining = header.length
+  crc = 0
+  for chunk in chunks:
+    chunk = bytes(chunk[:remaining])
+    crc = zlib.crc32(chunk, crc)
+    remaining -= len(chunk)
+    yield chunk
+    if remaining == 0:
+      break
+  if remaining:
+    raise ValueError("framed payload is truncated")
+  if crc != header.crc:
+    raise ValueError("framed payload checksum does not match")
+
+def read_frame(chunks, max_size=MAX_DECOMPRESSED_SIZE):
+  """
+  Reads a framed payload from a stream of chunks, stopping as soon as it is
+  complete. A compressed payload is decompressed as its chunks arrive.
+  :param chunks: iterable of bytes objects, such as from extract_binary_strips
+  :param int max_size: the most bytes a compressed payload may decompress to
+  :return: the FrameHeader and the payload
+  :raises ValueError: if the header is missing or the payload is truncated, corrupt or decompresses to too much
+  """
+  chunks = iter(chunks)
+  data = bytearray()
+  for chunk in chunks:
+    data += chunk
+    if len(data) >= FRAME_HEADER.size:
+      break
+  header = parse_frame_header(data)
+
+  payload = frame_chunks(header, itertools.chain([data[FRAME_HEADER.size:]], chunks))
+  if header.compression is None:
+    return header, b"".join(payload)
+  return header, decompress_chunks(header.compression, payload, max_size)
+
+@instrumented
+def extract_framed(image, BASE_COLOR, red, green, blue, reversed, direction_info=(True, True, True), strip_height=STRIP_HEIGHT, alpha=False, bits_per_channel=1):
+  """
+  Extracts a payload framed by frame_payload from an image. Only the strips of
+  rows up to the end of the payload are read.
+  :param Image image: The image file.
+  :param (int, int, int) BASE_COLOR: The base color containing the data.
+  :param bool red: whether red bit should be considered
+  :param bool green: whether green bit should be considered
+  :param bool blue: whether blue bit should be considered
+  :param bool reversed: whether rgb should actually be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to read in
+  :param int strip_height: the number of rows read at a time
+  :param bool alpha: whether the alpha bit should be considered, after the colors
+  :param int bits_per_channel: the number of last bits of each channel holding data, 1 to 4
+  :return: the payload
+  :raises ValueError: if the header is missing or the payload is truncated or corrupt
+  """
+  strips = array_strips(direction_view(carrier_pixels(image), direction_info), strip_height)
+  chunks = extract_binary_strips(strips, BASE_COLOR, red, green, blue, reversed, alpha=alpha, bits_per_channel=bits_per_channel)
+  header, payload = read_frame(chunks)
+  chunks.close()
+  return payload
+
+def lsb_cells(colors, red, green, blue):
+  """
+  Packs colors with the last bit of the channels holding data cleared, so that
+  every color a base color can become by writing data shares its cell.
+  :param numpy.ndarray colors: array whose last axis holds the channels of each color
+  :param bool red: whether red bit holds data
+  :param bool green: whether green bit holds data
+  :param bool blue: whether blue bit holds data
+  :return: array of the packed cells, with the last axis removed
+  """
+  return pack_colors(colors) & lsb_mask(red, green, blue)
+
+def lsb_mask(red, green, blue):
+  """
+  Builds the mask clearing the last bit of the channels holding data from packed colors.
+  :param bool red: whether red bit holds data
+  :param bool green: whether green bit holds data
+  :param bool blue: whether blue bit holds data
+  :return: the mask, as a numpy uint32
+  """
+  return np.uint32(~(red << 16 | green << 8 | blue) & 0xFFFFFF)
+
+def multi_carrier_indices(pixels, base_colors, red, green, blue, direction_info=(True, True, True)):
+  """
+  Lists the pixels holding data for a ranked list of base colors: every pixel in
+  the cell of the first base color in reading order, then those of the second, and so on.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param [(int, int, int)] base_colors: the base colors, in the order they are filled
+  :param bool red: whether red bit holds data
+  :param bool green: whether green bit holds data
+  :param bool blue: whether blue bit holds data
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to read in
+  :return: the flat indices of the pixels, in the order they hold data
+  """
+  cells = lsb_cells(np.array(base_colors, dtype=np.int64).reshape(-1, 3), red, green, blue)
+
+  # rank of the base color whose cell each pixel is in, or len(cells) if none
+  order = np.argsort(cells, kind="stable")
+  pixel_cells = lsb_cells(pixels, red, green, blue)
+  positions = np.minimum(np.searchsorted(cells[order], pixel_cells), len(cells) - 1)
+  ranks = np.where(cells[order][positions] == pixel_cells, order[positions], len(cells))
+
+  # reading order, then grouped by rank
+  pixel_indices = traversal_indices(ranks < len(cells), direction_info)
+  return pixel_indices[np.argsort(ranks.reshape(-1)[pixel_indices], kind="stable")]
+
+def choose_base_colors(image, count, red, green, blue):
+  """
+  Chooses the base colors with the most capacity for write_binary_multi.
+  :param Image image: The image file.
+  :param int count: the most base colors to choose
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :return: [(int, int, int)] the base colors, most pixels first
+  """
+  colors, counts = color_histogram(image)
+  cells, inverse = np.unique(lsb_cells(ColorIndex.channels(colors), red, green, blue), return_inverse=True)
+  cells, _ = top_colors(cells, np.bincount(inverse.reshape(-1), weights=counts).astype(np.int64), count)
+  return [unpack_color(cell) for cell in cells.tolist()]
+
+def base_color_cells_mask(pixels, BASE_COLOR, red, green, blue):
+  """
+  Finds the pixels in the cell of a base color, see lsb_cells.
+  :param numpy.ndarray pixels: array of shape (height, width, channels)
+  :param (int, int, int) BASE_COLOR: the base color
+  :param bool red: whether red bit holds data
+  :param bool green: whether green bit holds data
+  :param bool blue: whether blue bit holds data
+  :return: boolean numpy array of shape (height, width)
+  """
+  return lsb_cells(pixels, red, green, blue) == lsb_cells(np.array(BASE_COLOR[:3]), red, green, blue)
+
+def multi_carrier(image, red, green, blue, reversed):
+  """
+  Views the pixels of an image holding data spread across base colors, and the
+  channels holding it.
+  :param image: The image file, or an array of its pixels.
+  :param bool red: whether red bit holds data
+  :param bool green: whether green bit holds data
+  :param bool blue: whether blue bit holds data
+  :param bool reversed: whether rgb should be bgr
+  :return: the pixels, from carrier_pixels, and the channel indices, from carrier_channels
+  :raises ValueError: if the image is not 8-bit RGB, or no channel holds data
+  """
+  pixels = carrier_pixels(image)
+  if color_channels(pixels) == 1 or pixels.dtype != np.uint8:
+    raise ValueError("Data can only be spread across the base colors of 8-bit RGB images")
+  channels = carrier_channels(pixels, red, green, blue, reversed)
+  if not channels:
+    raise ValueError("No channel is selected to hold data")
+  return pixels, channels
+
+def write_binary_multi(image, bytes, base_colors, red, green, blue, reversed, direction_info=(True, True, True), compression=None, level=None):
+  """
+  Writes the binary data to an image spread across several base colors, filling
+  the pixels of each in turn. Every pixel that differs from a base color only
+  in the last bits of the channels holding data carries bits too. The data is
+  framed, after a header listing the base colors in the pixels of the first.
+  :param Image image: The image file, or an array of its pixels.
+  :param Bytes bytes: The raw data to write.
+  :param [(int, int, int)] base_colors: The base colors to contain the data, in order, such as from choose_base_colors.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param bool reversed: whether rgb should be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to write in
+  :param str compression: "zlib", "lzma" or "bz2" to compress the data first, or None
+  :param int level: the compression level, or None for the default of the compression
+  :return: The updated image, or array if given one.
+  :raises ValueError: if the image is not 8-bit RGB, no channel holds data, the base colors overlap, or the data does not fit
+  """
+  pixels, channels = multi_carrier(np.array(image), red, green, blue, reversed)
+  base_colors = [tuple(color[:3]) for color in base_colors]
+  if not 0 < len(base_colors) < 256:
+    raise ValueError("between 1 and 255 base colors are needed")
+  if len(set(lsb_cells(np.array(base_colors), red, green, blue).tolist())) < len(base_colors):
+    raise ValueError("base colors differ only in bits that hold data")
+
+  # the header, then the framed data
+  header = MULTI_HEADER.pack(MULTI_MAGIC, len(base_colors)) + b"".join(struct.pack("BBB", *color) for color in base_colors)
+  data = bytes_to_bits(header + frame_payload(bytes, red, green, blue, reversed, compression, level))
+
+  pixel_indices = multi_carrier_indices(pixels, base_colors, red, green, blue, direction_info)
+  first_capacity = np.count_nonzero(base_color_cells_mask(pixels, base_colors[0], red, green, blue)) * len(channels)
+  if first_capacity < len(header) * 8:
+    raise ValueError("the first base color cannot hold the header")
+  if len(pixel_indices) * len(channels) < len(data):
+    raise ValueError("data needs %d bits, the base colors hold %d" % (len(data), len(pixel_indices) * len(channels)))
+
+  embed_bits(pixels, pixel_indices, channels, data)
+  if isinstance(image, np.ndarray):
+    return pixels
+  return Image.frombytes(image.mode, image.size, pixels.tobytes())
+
+def extract_binary_multi(image, BASE_COLOR, red, green, blue, reversed, direction_info=(True, True, True)):
+  """
+  Extracts binary data written by write_binary_multi. Only the pixels up to the
+  end of the data are read.
+  :param Image image: The image file, or an array of its pixels.
+  :param (int, int, int) BASE_COLOR: The first base color the data was written to.
+  :param bool red: whether red bit should be considered
+  :param bool green: whether green bit should be considered
+  :param bool blue: whether blue bit should be considered
+  :param bool reversed: whether rgb should actually be bgr
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction to read in
+  :return: the payload
+  :raises ValueError: if the image is not 8-bit RGB, no channel holds data, there is no header, or the data is truncated or corrupt
+  """
+  pixels, channels = multi_carrier(image, red, green, blue, reversed)
+
+  def read(pixel_indices, length):
+    # the first length bytes held by the pixels
+    pixel_count = -(-length * 8 // len(channels))
+    return bits_to_bytes(gather_bits(pixels, pixel_indices[:pixel_count], channels))[:length]
+
+  # the header lists the base colors, in the pixels of the first
+  first = traversal_indices(base_color_cells_mask(pixels, BASE_COLOR, red, green, blue), direction_info)
+  magic, count = MULTI_HEADER.unpack(read(first, MULTI_HEADER.size).ljust(MULTI_HEADER.size, b"\x00"))
+  if magic != MULTI_MAGIC:
+    raise ValueError("no base color header found")
+  header_size = MULTI_HEADER.size + 3 * count
+  header = read(first, header_size)
+  base_colors = [tuple(header[i:i + 3]) for i in range(MULTI_HEADER.size, len(header) - 2, 3)]
+
+  # then the framed data, read only as far as its length
+  pixel_indices = multi_carrier_indices(pixels, base_colors, red, green, blue, direction_info)
+  frame_header = parse_frame_header(read(pixel_indices, header_size + FRAME_HEADER.size)[header_size:])
+  return unframe_payload(read(pixel_indices, header_size + FRAME_HEADER.size + frame_header.length)[header_size:])
+
+def count_colors(colors):
+  """
+  Counts packed colors as fast as possible, without keeping their order of appearance.
+  :param numpy.ndarray colors: The packed colors.
+  :return: numpy arrays of the distinct packed colors, in increasing order, and their counts
+  """
+  colors = colors.reshape(-1)
+  if colors.size < COLOR_SPACE // 16:
+    return np.unique(colors, return_counts=True)
+  counts = np.bincount(colors)
+  unique_colors = np.flatnonzero(counts)
+  return unique_colors.astype(np.uint32), counts[unique_colors]
+
+def first_pixel(image):
+  """
+  Views the first pixel of an image like carrier_pixels, to find its channels
+  from without converting the whole image.
+  :param Image image: the image, or an array of its pixels
+  :return: numpy array of shape (1, 1, channels)
+  """
+  if isinstance(image, Image.Image):
+    image = image.crop((0, 0, 1, 1))
+  return carrier_pixels(image)[:1, :1]
+
+def sorted_histogram(image, analysis=None):
+  """
+  Counts the colors of an image, reusing the histogram of an analysis if given.
+  Grayscale and palette images count their values as gray colors, like color_histogram.
+  :param Image image: The image file.
+  :param ImageAnalysis analysis: the analysis of the image to reuse, if any
+  :return: numpy arrays of the distinct packed colors, in increasing order, and their counts
+  :raises ValueError: if the image has more than 8 bits per channel
+  """
+  if analysis is None:
+    pixels = carrier_pixels(image)
+    if pixels.dtype != np.uint8:
+      raise ValueError("Only colors of 8-bit images can be counted")
+    if color_channels(pixels) == 1:
+      return count_colors(pixels[:, :, 0].astype(np.uint32) * 0x010101)
+    return count_colors(pack_colors(pixels))
+  colors, counts = analysis.histogram
+  order = np.argsort(colors)
+  return colors[order], counts[order]
+
+def capacity(image, red, green, blue, color_count=COLOR_COUNT, cells=False, bits_per_channel=1, analysis=None):
+  """
+  Computes how many bits can be written with each of the most common colors as
+  the base color, from a count of the colors rather than a scan of the pixels.
+  :param Image image: The image file.
+  :param bool red: whether red bit should contain bits
+  :param bool green: whether green bit should contain bits
+  :param bool blue: whether blue bit should contain bits
+  :param int color_count: the number of base colors to report
+  :param bool cells: whether to count the pixels write_binary_multi uses for each base
+  color, rather than the pixels exactly the base color that write_binary uses
+  :param int bits_per_channel: the number of last bits of each channel written to
+  :param ImageAnalysis analysis: the analysis of the image to reuse the histogram of, if any
+  :return: {(int,int,int) : int} the base colors to the bits they hold, most first.
+  Colors with the same capacity are in increasing order. Grayscale and palette
+  images hold one bit per pixel in their single channel, and report gray colors.
+  :raises ValueError: if bits_per_channel is not between 1 and 4
+  """
+  check_bits_per_channel(bits_per_channel)
+  pixel = first_pixel(image)
+  channel_count = len(carrier_channels(pixel, red, green, blue, False))
+  if color_channels(pixel) == 1:
+    # the single channel is packed as all three colors
+    red = green = blue = red or green or blue
+  colors, counts = sorted_histogram(image, analysis)
+  if cells:
+    # colors in the same cell are counted together
+    colors, cell_indices = np.unique(colors & lsb_mask(red, green, blue), return_inverse=True)
+    counts = np.bincount(cell_indices, weights=counts).astype(np.int64)
+  colors, counts = top_colors(colors, counts, color_count)
+  return {unpack_color(color): count * channel_count * bits_per_channel for color, count in zip(colors.tolist(), counts.tolist())}
+
+def recommend_base_color(image, payload_size=None, analysis=None):
+  """
+  Recommends the base color and channels with the most capacity for write_binary.
+  Given the size of a payload, recommends the fewest channels that fit it instead.
+  :param Image image: The image file.
+  :param int payload_size: the number of bytes to write, if known
+  :param ImageAnalysis analysis: the analysis of the image to reuse the histogram of, if any
+  :return: dict of the "base_color", "red", "green", "blue" and the "bits" they hold,
+  or None if the payload does not fit
+  """
+  colors, counts = top_colors(*sorted_histogram(image, analysis), 1)
+  if counts.size == 0:
+    return None
+  pixel = first_pixel(image)
+
+  # fewer channels change the image less, so they come first when a payload is given
+  subsets = [subset for subset in itertools.product([True, False], repeat=3) if any(subset)]
+  subsets.sort(key=lambda subset: sum(subset) if payload_size is not None else -sum(subset))
+  for red, green, blue in subsets:
+    bits = int(counts[0]) * len(carrier_channels(pixel, red, green, blue, False))
+    if payload_size is None or bits >= payload_size * 8:
+      return {"base_color": unpack_color(colors[0]), "red": red, "green": green, "blue": blue, "bits": bits}
+  return None
 
 def is_top_heavy(data, BASE_COLOR):
   """
@@ -311,6 +1817,92 @@ def is_top_heavy(data, BASE_COLOR):
 
 
 
+def in_range_mask(image, BASE_COLOR, CRYPT_DIST):
+  """
+  Finds the pixels within a distance of the base color.
+  :param Image image: image to search
+  :param (int, int, int) BASE_COLOR: the color which represents 0
+  :param float CRYPT_DIST: the maximum distance from the color that data could be
+  :return: boolean numpy array of shape (height, width), True where the pixel is in range
+  """
+
+  # largest squared distance whose distance is in range, exactly as compute_distance measures it
+  limit = int(CRYPT_DIST ** 2) + 1
+  while limit >= 0 and math.sqrt(limit) > CRYPT_DIST:
+    limit -= 1
+
+  pixels = carrier_pixels(image)
+  base = base_channels(pixels, BASE_COLOR)
+  wide = np.int32 if pixels.dtype == np.uint8 else np.int64
+  colors = pixels[:, :, :len(base)].astype(wide) - base.astype(wide)
+  return np.einsum("ijk,ijk->ij", colors, colors) <= limit
+
+@instrumented
+def data_masks(image, BASE_COLOR, CRYPT_DIST):
+  """
+  Finds the pixels in range of the base color, and those of them holding data.
+  :param Image image: image to search
+  :param (int, int, int) BASE_COLOR: the color which represents 0
+  :param float CRYPT_DIST: the maximum distance from the color that data could be
+  :return: boolean numpy arrays in_range, data of shape (height, width)
+  """
+  in_range = in_range_mask(image, BASE_COLOR, CRYPT_DIST)
+  pixels = carrier_pixels(image)
+  base = base_channels(pixels, BASE_COLOR)
+  data = in_range & np.any(pixels[:, :, :len(base)] != base, axis=2)
+  return in_range, data
+
+def zero_runs(in_range, data):
+  """
+  Measures the zeros around the data of each row, as is_top_heavy would for the
+  list of in range pixels in that row read from left to right.
+  :param numpy.ndarray in_range: boolean array, True where the pixel is in range
+  :param numpy.ndarray data: boolean array, True where the pixel holds data
+  :return: numpy arrays has_data, left_0_len, right_0_len for each row
+  """
+  has_data = data.any(axis=1)
+  first = np.argmax(data, axis=1)
+  last = data.shape[1] - 1 - np.argmax(data[:, ::-1], axis=1)
+
+  # in range pixels up to and including each pixel
+  in_range_count = np.cumsum(in_range, axis=1, dtype=np.int32)
+  total = in_range_count[:, -1]
+  rows = np.arange(data.shape[0])
+  left_0_len = np.where(has_data, in_range_count[rows, first] - 1, total)
+  right_0_len = np.where(has_data, total - in_range_count[rows, last], total)
+  return has_data, left_0_len, right_0_len
+
+@instrumented
+def top_heaviness_scores(in_range, data):
+  """
+  Computes get_top_heaviness for the image rotated by each of 0, 90, 180, and 270
+  degrees, from the masks of the unrotated image.
+  :param numpy.ndarray in_range: boolean array, True where the pixel is in range
+  :param numpy.ndarray data: boolean array, True where the pixel holds data
+  :return: {int : float} the degrees to the 'top-heaviness' of the rotated image
+  """
+
+  # columns of the 0 and 180 degree images are the columns, read down or up. Columns
+  # of the 90 and 270 degree images are the rows, read from right or left.
+  column_runs = zero_runs(in_range.T, data.T)
+  row_runs = zero_runs(in_range, data)
+  lines = {
+    0: (column_runs, False),
+    90: (row_runs, True),
+    180: (column_runs, True),
+    270: (row_runs, False),
+  }
+
+  scores = {}
+  for degrees, ((has_data, left_0_len, right_0_len), backwards) in lines.items():
+    top_heavy = right_0_len < left_0_len if backwards else left_0_len < right_0_len
+    heaviness_sum = int(np.count_nonzero(top_heavy & has_data)) - 3 * int(np.count_nonzero(~has_data))
+    if heaviness_sum < 0:
+      heaviness_sum = 0
+    scores[degrees] = heaviness_sum / len(has_data)
+  return scores
+
+@instrumented
 def get_top_heaviness(image, BASE_COLOR, CRYPT_DIST):
   """
   Determines whether the top has more data than the bottom.
@@ -323,40 +1915,34 @@ def get_top_heaviness(image, BASE_COLOR, CRYPT_DIST):
   zeros. For example, the entire data could be a white region at the bottom, but the image
   could still be "top heavy" if within that region the data is at the top.
   """
+  return top_heaviness_scores(*data_masks(image, BASE_COLOR, CRYPT_DIST))[0]
 
-  width, height = image.size
-  pixels = image.load()
-
-  # iterate through the coloumn space of the image
-  # initialize master list of "top-heaviness" for each column
-  top_heaviness = []
-  for x in range(width):
-    # initialize empty list of data in column
-    col_data = []
-    # loop through column, appending all 0s and data to list
-    all_zeros = True
-    for y in range(height):
-      rgba = pixels[x,y]
-      (r, g, b) = (rgba[0], rgba[1], rgba[2])
-      if(compute_distance((r,g,b),BASE_COLOR) <= CRYPT_DIST):
-        if not (r,g,b) == BASE_COLOR:
-          all_zeros = False
-        col_data.append((r,g,b))
-    # determine "top-heaviness" of list, and append to master list
-    if all_zeros:
-      top_heavy = -3
-    else:
-      top_heavy = is_top_heavy(col_data, BASE_COLOR)
-    top_heaviness.append(top_heavy)
-    
-  # compute whole top heaviness as percent, using master list
-  heaviness_sum = sum(top_heaviness)
-  if heaviness_sum < 0:
-    heaviness_sum = 0
-  return heaviness_sum / len(top_heaviness)
+@instrumented
+def mirrored_from_masks(in_range, data, degrees=0):
+  """
+  Computes is_mirrored for the image rotated by degrees, from the masks of the
+  unrotated image.
+  :param numpy.ndarray in_range: boolean array, True where the pixel is in range
+  :param numpy.ndarray data: boolean array, True where the pixel holds data
+  :param int degrees: the degrees the image is rotated. Must be 0, 90, 180, or 270.
+  :return: True iff data is read right-to-left.
+  """
 
-  
-  
+  # rotated views, no pixels are copied
+  in_range = np.rot90(in_range, degrees // 90)
+  data = np.rot90(data, degrees // 90)
+
+  # the row above the first row without data, or the last row
+  empty_rows = np.flatnonzero(~data.any(axis=1))
+  row = empty_rows[0] - 1 if empty_rows.size else -1
+  if row == -1:
+    row = data.shape[0] - 1
+
+  # whether the data and zeros in that row are top heavy
+  has_data, left_0_len, right_0_len = zero_runs(in_range[row:row + 1], data[row:row + 1])
+  return not left_0_len[0] < right_0_len[0]
+
+@instrumented
 def is_mirrored(image, BASE_COLOR, CRYPT_DIST):
   """
   determines if a top-heavy image is mirrored, in that it should be
@@ -367,53 +1953,93 @@ def is_mirrored(image, BASE_COLOR, CRYPT_DIST):
   :param float CRYPT_DIST: the acceptable distance from the base color.
   :return: True iff data is read right-to-left.
   """
-  
-  width, height = image.size
-  pixels = image.load()
-  
-  row = -1
-  for y in range(height):
-    all_zeros = True
-    for x in range(width):
-      if compute_distance(pixels[x,y],BASE_COLOR) <= CRYPT_DIST and pixels[x,y] != BASE_COLOR:
-        all_zeros = False
-        break
-    if all_zeros:
-      row = y - 1
-      break
-  if row == -1:
-    row = height - 1
+  return mirrored_from_masks(*data_masks(image, BASE_COLOR, CRYPT_DIST))
 
-  # get a list of all the data in row including the 0s
-  data = []
-  for x in range(width):
-    if(compute_distance(pixels[x,row],BASE_COLOR) <= CRYPT_DIST):
-        data.append(pixels[x,row])
-
-  # return whether that list is top heavy
-  return not is_top_heavy(data, BASE_COLOR)
+class ImageAnalysis:
+  """
+  Analysis of one image shared between the stages of automatic decryption.
+  Each result is computed the first time it is asked for and then reused.
+  """
 
-def guess_base_color(image):
+  def __init__(self, image):
+    """
+    Starts an analysis of an image.
+    :param Image image: the image to analyze
+    """
+    self.image = image
+    self.top_color_cache = {}
+    self.color_index_cache = {}
+    self.base_color_cache = {}
+    self.data_mask_cache = {}
+
+  @functools.cached_property
+  def histogram(self):
+    """
+    :return: the compact color histogram of the image, from color_histogram
+    """
+    return color_histogram(self.image)
+
+  def top_colors(self, color_count=COLOR_COUNT):
+    """
+    :param int color_count: the number of most common colors
+    :return: the packed most common colors and their counts, from top_colors
+    """
+    if color_count not in self.top_color_cache:
+      self.top_color_cache[color_count] = top_colors(*self.histogram, color_count)
+    return self.top_color_cache[color_count]
+
+  def color_index(self, color_count=COLOR_COUNT):
+    """
+    :param int color_count: the number of most common colors
+    :return: a ColorIndex over the most common colors, most common first
+    """
+    if color_count not in self.color_index_cache:
+      self.color_index_cache[color_count] = ColorIndex(self.top_colors(color_count)[0])
+    return self.color_index_cache[color_count]
+
+  def base_color(self, color_count=COLOR_COUNT):
+    """
+    :param int color_count: the number of most common colors to consider
+    :return: the guessed base color and its distance, from guess_base_color
+    """
+    if color_count not in self.base_color_cache:
+      self.base_color_cache[color_count] = guess_base_color(self.image, color_count, analysis=self)
+    return self.base_color_cache[color_count]
+
+  def data_masks(self, BASE_COLOR, CRYPT_DIST):
+    """
+    :param (int, int, int) BASE_COLOR: the color which represents 0
+    :param float CRYPT_DIST: the maximum distance from the color that data could be
+    :return: the in range and data masks of the image, from data_masks
+    """
+    key = (tuple(BASE_COLOR), CRYPT_DIST)
+    if key not in self.data_mask_cache:
+      self.data_mask_cache[key] = data_masks(self.image, BASE_COLOR, CRYPT_DIST)
+    return self.data_mask_cache[key]
+
+@instrumented
+def guess_base_color(image, color_count=COLOR_COUNT, analysis=None):
   """
   Guesses the base color from an image.
   :author: Alec
   :param Image image: the image to parse
+  :param int color_count: the number of most common colors to consider
+  :param ImageAnalysis analysis: the analysis of the image to reuse, if any
   :return: the guessed base color and its distance (int,int,int), int
   """
 
-  # this can be updated
-  COLOR_COUNT = 30
-  colors = extract_common_colors(extract_colors(image), COLOR_COUNT)
+  if analysis is None:
+    analysis = ImageAnalysis(image)
+  index = analysis.color_index(color_count)
   
   guessed_color = (-1, -1, -1)
   max_close = 0
 
-  # extract colors
-  for color in colors.keys():
-    close_color_count = len(get_close_colors(colors, color))
-    if close_color_count > max_close:
-      max_close = close_color_count
-      guessed_color = color
+  # the first of the most common colors with the most close colors
+  close_counts = index.close_counts()
+  if close_counts.size and close_counts.max() > 0:
+    max_close = int(close_counts.max())
+    guessed_color = unpack_color(index.colors[np.argmax(close_counts)])
   
   # guess a max distance
   if max_close == 1:
@@ -423,33 +2049,37 @@ def guess_base_color(image):
     
   return (guessed_color, max_distance)
 
-def guess_direction_info(image):
+@instrumented
+def guess_direction_info(image, analysis=None):
   """
   Guesses direction info from image.
   :author: Alec
   :param Image image: image to parse
+  :param ImageAnalysis analysis: the analysis of the image to reuse, if any
   :return: bool horiz_first, bool top_to_bottom, bool left_to_right
   """
 
-  BASE_COLOR, CRYPT_DIST = guess_base_color(image)
+  if analysis is None:
+    analysis = ImageAnalysis(image)
+  BASE_COLOR, CRYPT_DIST = analysis.base_color()
+  masks = analysis.data_masks(BASE_COLOR, CRYPT_DIST)
+  scores = top_heaviness_scores(*masks)
   max_top_heaviness = 0
   top_heavy_degrees = 0
   for degrees in [0, 90, 180, 270]:
-    test_image = rotate_image(image, degrees)
-    top_heaviness = get_top_heaviness(test_image, BASE_COLOR, CRYPT_DIST)
+    top_heaviness = scores[degrees]
     if top_heaviness > max_top_heaviness:
       max_top_heaviness = top_heaviness
       top_heavy_degrees = degrees
 
-  top_heavy_image = rotate_image(image, top_heavy_degrees)
   if top_heavy_degrees % 180 == 0:
     horiz_first = True
     top_to_bottom = top_heavy_degrees == 0
-    left_to_right = not is_mirrored(top_heavy_image, BASE_COLOR, CRYPT_DIST)
+    left_to_right = not mirrored_from_masks(*masks, top_heavy_degrees)
   else:
     horiz_first = False
     left_to_right = top_heavy_degrees == 90
-    top_to_bottom = not is_mirrored(top_heavy_image, BASE_COLOR, CRYPT_DIST)
+    top_to_bottom = not mirrored_from_masks(*masks, top_heavy_degrees)
   return horiz_first, top_to_bottom, left_to_right
   
 
@@ -475,6 +2105,7 @@ def prompt_direction_info():
   left_to_right = input("Left to right or right to left? (lr,rl): ") == "lr"
   return horiz_first, top_to_bottom, left_to_right
   
+@instrumented
 def to_direction(image, direction_info):
   """
   Position image in a specified direction
@@ -501,12 +2132,50 @@ def to_direction(image, direction_info):
 
 
 
-def encrypt(bytes, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed):
+def direction_view(pixels, direction_info):
+  """
+  Views a pixel array positioned in a specified direction, like to_direction,
+  without copying any pixels.
+  :param numpy.ndarray pixels: array of shape (height, width, ...)
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction info of image
+  :return: a view of the array positioned to direction
+  """
+
+  mirrored = not (direction_info[0] ^ direction_info[1] ^ direction_info[2])
+  if mirrored:
+    pixels = pixels[:, ::-1]
+    direction_info = (direction_info[0], direction_info[1] ^ (not direction_info[0]), direction_info[2] ^ direction_info[0])
+
+  # np.rot90 turns counter-clockwise, like rotate_image
+  if direction_info[1] and not direction_info[2]:
+    pixels = np.rot90(pixels, 3)
+  elif not direction_info[1] and not direction_info[2]:
+    pixels = np.rot90(pixels, 2)
+  elif not direction_info[1] and direction_info[2]:
+    pixels = np.rot90(pixels, 1)
+
+  return pixels
+
+def traversal_indices(mask, direction_info=(True, True, True)):
+  """
+  Lists the pixels of a mask in the order they are read in a specified direction.
+  :param numpy.ndarray mask: boolean array of shape (height, width)
+  :param direction_info (bool horiz_first, bool top_to_bottom, bool left_to_right): direction info of image
+  :return: the flat indices into the unpositioned image of the pixels that are True, in reading order
+  """
+  if tuple(direction_info) == (True, True, True):
+    return np.flatnonzero(mask)
+
+  # read the index of every pixel through the same view as the mask
+  indices = np.arange(mask.size).reshape(mask.shape)
+  return direction_view(indices, direction_info)[direction_view(mask, direction_info)]
+
+def encrypt(bytes, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False, in_place=False, alpha=False, bits_per_channel=1, compression=None, level=None):
   """
   Encrypts inputted data into image using settings defined by input
   :author: Kyle
   :param Bytes bytes: binary data to be encrypted
-  :param Image image: image to encrypt data into
+  :param Image image: image to encrypt data into, or an array of its pixels
   :param bool horiz-first: Encrypt data horizontally or vertically
   :param bool top_to_bottom: Encrypt data top to bottom or bottom to top
   :param bool left_to_right: Encrypt data left to right or right to left
@@ -515,30 +2184,107 @@ def encrypt(bytes, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR,
   :param bool blue: whether blue should be included or not
   :param bool green: whether green should be included or not
   :param bool reversed: whether rgb should be bgr
+  :param bool framed: whether to frame the data with its length and checksum
+  :param bool in_place: whether to write into the image itself rather than a copy, see write_binary
+  :param bool alpha: whether alpha should be included, after the colors
+  :param int bits_per_channel: the number of last bits of each channel to encrypt to, 1 to 4
+  :param str compression: "zlib", "lzma" or "bz2" to compress the data first, which frames it, or None
+  :param int level: the compression level, or None for the default of the compression
   :return: image with encrypted data
   """
 
-  # Position Image so starting position is top left corner, going from left to right then top to bottom
-  image = to_direction(image, (horiz_first, top_to_bottom, left_to_right))
-  
-  image = write_binary(image, bytes, BASE_COLOR, red, green, blue, reversed)
+  if framed or compression is not None:
+    bytes = frame_payload(bytes, red, green, blue, reversed, compression, level)
 
-  image = to_direction(image, (horiz_first, left_to_right, top_to_bottom))
+  # Write in the direction's reading order, without positioning the image
+  image = write_binary(image, bytes, BASE_COLOR, red, green, blue, reversed, (horiz_first, top_to_bottom, left_to_right), in_place, alpha, bits_per_channel)
 
   return image
     
 
+class PreparedCarrier:
+  """
+  An image prepared once to have many payloads encrypted into it with the same
+  settings. The pixels that can hold data are found in advance, so encrypting
+  each payload only copies the pixels and writes the bits it needs.
+  """
+
+  def __init__(self, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, alpha=False, bits_per_channel=1):
+    """
+    Prepares an image, with the same settings as encrypt.
+    :param Image image: image to encrypt data into
+    :param bool horiz_first: Encrypt data horizontally or vertically
+    :param bool top_to_bottom: Encrypt data top to bottom or bottom to top
+    :param bool left_to_right: Encrypt data left to right or right to left
+    :param (int, int, int) BASE_COLOR: Base color to encrypt data to
+    :param bool red: whether red should be included or not
+    :param bool green: whether green should be included or not
+    :param bool blue: whether blue should be included or not
+    :param bool reversed: whether rgb should be bgr
+    :param bool alpha: whether alpha should be included, after the colors
+    :param int bits_per_channel: the number of last bits of each channel to encrypt to, 1 to 4
+    :raises ValueError: if bits_per_channel is not between 1 and 4
+    """
+    check_bits_per_channel(bits_per_channel)
+    self.mode = image.mode
+    self.size = image.size
+    self.settings = (red, green, blue, reversed)
+    self.bits_per_channel = bits_per_channel
+
+    # the unwritten pixels
+    self.palette = image.palette.copy() if image.mode in ("P", "PA") else None
+    self.pixels = carrier_pixels(np.array(image))
+
+    # every pixel that can hold bits, in write order, and the channels holding them
+    self.pixel_indices = traversal_indices(base_color_mask(self.pixels, BASE_COLOR), (horiz_first, top_to_bottom, left_to_right))
+    self.channels = carrier_channels(self.pixels, red, green, blue, reversed, alpha)
+
+  @property
+  def capacity(self):
+    """
+    :return: the number of bits that can be written
+    """
+    return len(self.pixel_indices) * len(self.channels) * self.bits_per_channel
+
+  def encrypt(self, bytes, framed=False, compression=None, level=None):
+    """
+    Encrypts a payload into a copy of the prepared image, like encrypt.
+    :param Bytes bytes: binary data to be encrypted
+    :param bool framed: whether to frame the data with its length and checksum
+    :param str compression: "zlib", "lzma" or "bz2" to compress the data first, which frames it, or None
+    :param int level: the compression level, or None for the default of the compression
+    :return: image with encrypted data
+    """
+    if framed or compression is not None:
+      bytes = frame_payload(bytes, *self.settings, compression, level)
+
+    # only the pixels up to the last bit are written
+    data = bytes_to_bits(bytes)
+    pixels = self.pixels.copy()
+    if self.channels:
+      pixel_count = -(-len(data) // (len(self.channels) * self.bits_per_channel))
+      embed_bits(pixels, self.pixel_indices[:pixel_count], self.channels, data, self.bits_per_channel)
+
+    image = Image.fromarray(pixels[:, :, 0] if pixels.shape[2] == 1 else pixels)
+    if self.palette is not None:
+      image.putpalette(self.palette.palette, self.palette.mode)
+    if image.mode != self.mode:
+      # modes fromarray cannot tell from the array, such as RGBX
+      image = Image.frombytes(self.mode, self.size, pixels.tobytes())
+    return image
+
+@instrumented
 def decrypt_auto(image):
   """
   Decrypts image automatically, by trying all possibilities
   :param Image image: image to decrypt
   :return: Bytes bytes: decrypted binary data
   """
-  horiz_first, top_to_bottom, left_to_right = guess_direction_info(image)
+  analysis = ImageAnalysis(image)
+  horiz_first, top_to_bottom, left_to_right = guess_direction_info(image, analysis)
 
-  (BASE_COLOR, _) = guess_base_color(image)
-  COLOR_COUNT = 30
-  close_colors = get_close_colors(extract_common_colors(extract_colors(image), COLOR_COUNT), BASE_COLOR)
+  (BASE_COLOR, _) = analysis.base_color()
+  close_colors = analysis.color_index().close(BASE_COLOR)
   
   red, blue, green = False, False, False
   # loop through close colors
@@ -550,11 +2296,15 @@ def decrypt_auto(image):
     if(color[2] & 1 == 1):
       blue = True
 
-  return decrypt(image,horiz_first,top_to_bottom,left_to_right,BASE_COLOR,red,green,blue,False)
+  # framed data can be read exactly, anything else is read to the end of the image
+  try:
+    return decrypt(image,horiz_first,top_to_bottom,left_to_right,BASE_COLOR,red,green,blue,False,framed=True)
+  except ValueError:
+    return decrypt(image,horiz_first,top_to_bottom,left_to_right,BASE_COLOR,red,green,blue,False)
 
   
 
-def decrypt(image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed):
+def decrypt(image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False, alpha=False, bits_per_channel=1):
   """
   Decrypts image using settings defined by input
   :author: Kyle
@@ -563,15 +2313,149 @@ def decrypt(image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, g
   :param bool top_to_bottom: Decrypt data top to bottom or bottom to top
   :param bool left_to_right: Decrypt data left to right or right to left
   :param bool reversed: whether rgb should be bgr
+  :param bool framed: whether the data was framed by encrypt, in which case only the payload is read
+  :param bool alpha: whether alpha was included, after the colors
+  :param int bits_per_channel: the number of last bits of each channel holding data, 1 to 4
   :return: Bytes bytes: decrypted binary data
   """
-  # Position Image so starting position is top left corner, going from left to right then top to bottom
-  image = to_direction(image, (horiz_first, top_to_bottom, left_to_right))
-  
-  binary = extract_binary(image, BASE_COLOR, red, green, blue, reversed)
+  if framed:
+    return extract_framed(image, BASE_COLOR, red, green, blue, reversed, (horiz_first, top_to_bottom, left_to_right), alpha=alpha, bits_per_channel=bits_per_channel)
+
+  # Read in the direction's reading order, without positioning the image
+  binary = extract_binary(image, BASE_COLOR, red, green, blue, reversed, (horiz_first, top_to_bottom, left_to_right), alpha=alpha, bits_per_channel=bits_per_channel)
 
   return binary
 
+def plausibility(data):
+  """
+  Scores how likely decoded data is to be a real payload rather than noise,
+  from known magic bytes, the ratio of printable and alphanumeric bytes, and
+  the entropy.
+  :param Bytes data: the decoded data
+  :return: a score, higher is more plausible. Empty data scores 0.
+  """
+
+  # padding past the end of the payload decodes as 0s
+  data = data.rstrip(b"\x00")
+  if not data:
+    return 0.0
+
+  score = 0.0
+  if any(data.startswith(magic) for magic in KNOWN_MAGIC):
+    score += 2
+
+  # printable bytes, and of those the letters and digits that make up most text
+  values = np.frombuffer(data, dtype=np.uint8)
+  printable = ((values >= 0x20) & (values < 0x7F)) | (values == 0x09) | (values == 0x0A) | (values == 0x0D)
+  alphanumeric = np.isin(values, np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789", dtype=np.uint8))
+  score += np.count_nonzero(printable) / values.size + np.count_nonzero(alphanumeric) / values.size
+
+  # entropy in bits per byte: near 0 for repeated patterns, 8 for noise, around 4 for text
+  counts = np.bincount(values, minlength=256)
+  frequencies = counts[counts > 0] / values.size
+  entropy = -np.sum(frequencies * np.log2(frequencies))
+  score += min(entropy, 8 - entropy) / 4
+  return float(score)
+
+def brute_force_candidates(base_colors):
+  """
+  Enumerates every setting a payload could have been encrypted with. Reversing
+  a single channel changes nothing, so those settings are only listed once.
+  :param [(int, int, int)] base_colors: the base colors to try
+  :return: list of (BASE_COLOR, direction_info, red, green, blue, reversed) tuples
+  """
+  candidates = []
+  for BASE_COLOR in base_colors:
+    for direction_info in itertools.product([True, False], repeat=3):
+      for red, green, blue in itertools.product([True, False], repeat=3):
+        for reversed in [False, True]:
+          if red + green + blue == 0 or (reversed and red + green + blue == 1):
+            continue
+          candidates.append((BASE_COLOR, direction_info, red, green, blue, reversed))
+  return candidates
+
+# in a brute force worker process, the shared memory block and the pixel array over it
+shared_pixels = None
+
+def attach_shared_pixels(name, shape, dtype):
+  """
+  Attaches a worker process to the pixel array shared by decrypt_brute_force.
+  :param str name: the name of the shared memory block
+  :param (int, int, int) shape: the shape of the pixel array
+  :param str dtype: the dtype of the pixel array
+  """
+  global shared_pixels
+  memory = multiprocessing.shared_memory.SharedMemory(name=name)
+  # keep the block open for as long as the worker uses the array
+  shared_pixels = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+
+def score_candidate(candidate):
+  """
+  Decodes the start of the shared pixel array with one candidate setting and scores it.
+  :param candidate: (BASE_COLOR, direction_info, red, green, blue, reversed)
+  :return: the plausibility score of the decoded sample
+  """
+  BASE_COLOR, direction_info, red, green, blue, reversed = candidate
+  strips = array_strips(direction_view(shared_pixels[1], direction_info))
+  sample = b"".join(extract_binary_strips(strips, BASE_COLOR, red, green, blue, reversed, BRUTE_FORCE_SAMPLE))
+  score = plausibility(sample)
+
+  # a valid frame is as plausible as it gets
+  try:
+    unframe_payload(sample)
+    score += 4
+  except ValueError:
+    pass
+  return score
+
+def decrypt_brute_force(image, color_count=BRUTE_FORCE_COLORS, workers=None, keep=5):
+  """
+  Decrypts image by trying every direction, channel subset and channel order
+  with each of the most common colors as the base color, ranking the results
+  by how plausible the start of the decoded data is. The pixels are shared
+  with the worker processes instead of being sent with every attempt.
+  :param Image image: image to decrypt
+  :param int color_count: the number of most common colors to try as the base color
+  :param int workers: the number of worker processes, or None for one per CPU
+  :param int keep: the number of best results to fully decrypt
+  :return: list of dicts of the score and settings of each attempt, best first. The
+  best keep also have the decrypted "data", read exactly if it was framed.
+  """
+  colors, _ = top_colors(*color_histogram(image), color_count)
+  candidates = brute_force_candidates([unpack_color(color) for color in colors.tolist()])
+
+  # copy the pixels into shared memory once, for every worker to read
+  pixels = np.asarray(image)
+  memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+  try:
+    np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=memory.buf)[...] = pixels
+    with concurrent.futures.ProcessPoolExecutor(
+      max_workers=workers, initializer=attach_shared_pixels, initargs=(memory.name, pixels.shape, pixels.dtype.str)
+    ) as executor:
+      scores = list(executor.map(score_candidate, candidates, chunksize=max(len(candidates) // (4 * (workers or os.cpu_count() or 1)), 1)))
+  finally:
+    memory.close()
+    memory.unlink()
+
+  results = [{
+    "score": score,
+    "base_color": BASE_COLOR,
+    "direction_info": direction_info,
+    "red": red,
+    "green": green,
+    "blue": blue,
+    "reversed": reversed,
+  } for score, (BASE_COLOR, direction_info, red, green, blue, reversed) in zip(scores, candidates)]
+  results.sort(key=lambda result: -result["score"])
+
+  for result in results[:keep]:
+    settings = (image, *result["direction_info"], result["base_color"], result["red"], result["green"], result["blue"], result["reversed"])
+    try:
+      result["data"] = decrypt(*settings, framed=True)
+    except ValueError:
+      result["data"] = decrypt(*settings)
+  return results
+
 def main():
   """
   Prompts for the following:
@@ -642,5 +2526,179 @@ def main():
     with open(out_file_path, "wb") as file:
       file.write(output)
 
+IMAGE_EXTENSIONS = {".png", ".bmp", ".ppm", ".pgm", ".tif", ".tiff", ".gif", ".webp"}
+
+def collect_image_paths(paths, manifest=None):
+  """
+  Lists the image files named on the command line.
+  :param [str] paths: image files, or directories whose image files are used
+  :param str manifest: a file listing one image path per line, if any
+  :return: the image paths, in order
+  """
+  if manifest is not None:
+    with open(manifest) as manifest_file:
+      paths = list(paths) + [line.strip() for line in manifest_file if line.strip()]
+
+  image_paths = []
+  for path in paths:
+    if os.path.isdir(path):
+      image_paths += sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+      )
+    else:
+      image_paths.append(path)
+  return image_paths
+
+def process_image(task):
+  """
+  Encrypts or decrypts one image for the command line, in a worker process.
+  :param dict task: the mode, image path, output path and settings
+  :return: dict reporting the paths, whether it succeeded, any error, the time taken, and each stage's profile if asked for
+  """
+  start = time.perf_counter()
+  result = {"path": task["path"], "output": task["output"], "ok": True, "error": None}
+  if task.get("profile"):
+    with profile(allocations=True) as timings:
+      process_task(task, result)
+    result["profile"] = profile_summary(timings)
+  else:
+    process_task(task, result)
+  result["seconds"] = time.perf_counter() - start
+  return result
+
+def process_task(task, result):
+  """
+  Runs one task of process_image, recording its output or error in its result.
+  :param dict task: the mode, image path, output path and settings
+  :param dict result: the result to record the bytes decrypted, settings and any error in
+  """
+  try:
+    if task.get("duplicate"):
+      raise ValueError("output %s would also be written for another image" % task["output"])
+    image = Image.open(task["path"])
+    if task["mode"] == "encrypt":
+      # compressed data is streamed from the file, anything else is read whole
+      with open(task["data"], "rb") as data_file:
+        data = data_file if task["compression"] else data_file.read()
+        output = encrypt(data, image, *task["direction_info"], task["base_color"], *task["channels"], task["reversed"], task["framed"], alpha=task["alpha"], bits_per_channel=task["bits"], compression=task["compression"], level=task["level"])
+      output.save(task["output"])
+    else:
+      if task["mode"] == "auto":
+        output = decrypt_auto(image)
+      elif task["mode"] == "brute":
+        best = decrypt_brute_force(image, workers=task["workers"], keep=1)[0]
+        output = best.pop("data")
+        result["settings"] = best
+      else:
+        output = decrypt(image, *task["direction_info"], task["base_color"], *task["channels"], task["reversed"], task["framed"], task["alpha"], task["bits"])
+      with open(task["output"], "wb") as file:
+        file.write(output)
+      result["bytes"] = len(output)
+  except Exception as error:
+    result["ok"] = False
+    result["error"] = "%s: %s" % (type(error).__name__, error)
+
+def parse_args(argv):
+  """
+  Parses the command line, whose options mirror the prompts of main.
+  :param [str] argv: the arguments, without the program name
+  :return: the parsed arguments
+  """
+  parser = argparse.ArgumentParser(description="Encode or decode data hidden in similar pixels of many images.")
+  parser.add_argument("mode", choices=["encrypt", "decrypt", "auto", "brute"], help="encrypt, decrypt with settings, decrypt automatically, or decrypt by trying every setting")
+  parser.add_argument("paths", nargs="*", help="image files, or directories of image files")
+  parser.add_argument("--manifest", help="file listing one image path per line")
+  parser.add_argument("--output-dir", required=True, help="directory to write the encrypted images or decrypted data to")
+  parser.add_argument("--data", help="data file to encrypt into every image")
+  parser.add_argument("--first", choices=["h", "v"], default="h", help="horizontal or vertical first")
+  parser.add_argument("--vertical", choices=["tb", "bt"], default="tb", help="top to bottom or bottom to top")
+  parser.add_argument("--horizontal", choices=["lr", "rl"], default="lr", help="left to right or right to left")
+  parser.add_argument("--base-color", nargs=3, type=int, metavar=("RED", "GREEN", "BLUE"), help="base color in RGB, 0-255")
+  parser.add_argument("--red", action="store_true", help="include red bit")
+  parser.add_argument("--green", action="store_true", help="include green bit")
+  parser.add_argument("--blue", action="store_true", help="include blue bit")
+  parser.add_argument("--reversed", action="store_true", help="reversed (rgb -> bgr)")
+  parser.add_argument("--alpha", action="store_true", help="include alpha bit, after the colors")
+  parser.add_argument("--bits", type=int, choices=BITS_PER_CHANNEL, default=1, help="number of last bits of each channel holding data")
+  parser.add_argument("--framed", action="store_true", help="frame the data with its length and checksum")
+  parser.add_argument("--compress", choices=sorted(COMPRESSIONS), help="compress the data before encrypting it, which frames it")
+  parser.add_argument("--level", type=int, help="compression level, defaulting to that of the compression")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+  parser.add_argument("--profile", action="store_true", help="report the time, pixels and memory of each stage of each image")
+  parser.add_argument("--summary", help="file to write the JSON summary to, instead of standard output")
+  args = parser.parse_args(argv)
+
+  if args.mode in ["encrypt", "decrypt"] and args.base_color is None:
+    parser.error("--base-color is required to %s" % args.mode)
+  if args.mode == "encrypt" and args.data is None:
+    parser.error("--data is required to encrypt")
+  return args
+
+def cli(argv=None):
+  """
+  Encrypts or decrypts a batch of images without prompting, across a pool of
+  worker processes, and reports a JSON summary of the results and timings.
+  :param [str] argv: the arguments, without the program name. Defaults to sys.argv.
+  :return: the exit status, 0 if every image succeeded
+  """
+  args = parse_args(sys.argv[1:] if argv is None else argv)
+  start = time.perf_counter()
+
+  # one task per image, written to the output directory under the image's name
+  os.makedirs(args.output_dir, exist_ok=True)
+  extension = ".png" if args.mode == "encrypt" else ".bin"
+  tasks = [{
+    "mode": args.mode,
+    "path": path,
+    "output": os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + extension),
+    "data": args.data,
+    "direction_info": (args.first == "h", args.vertical == "tb", args.horizontal == "lr"),
+    "base_color": tuple(args.base_color) if args.base_color else None,
+    "channels": (args.red, args.green, args.blue),
+    "reversed": args.reversed,
+    "alpha": args.alpha,
+    "bits": args.bits,
+    "framed": args.framed or args.compress is not None,
+    "compression": args.compress,
+    "level": args.level,
+    "workers": args.workers,
+    "profile": args.profile,
+  } for path in collect_image_paths(args.paths, args.manifest)]
+
+  # images with the same name in different directories, or with different
+  # extensions, would overwrite each other's output, so none of them are run
+  outputs = collections.Counter(os.path.normcase(task["output"]) for task in tasks)
+  for task in tasks:
+    task["duplicate"] = outputs[os.path.normcase(task["output"])] > 1
+
+  # brute force spreads each image across the workers itself
+  if args.mode == "brute":
+    results = [process_image(task) for task in tasks]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+      results = list(executor.map(process_image, tasks))
+
+  for result in results:
+    if not result["ok"]:
+      print("%s: %s" % (result["path"], result["error"]), file=sys.stderr)
+
+  summary = {
+    "mode": args.mode,
+    "workers": args.workers,
+    "succeeded": sum(result["ok"] for result in results),
+    "failed": sum(not result["ok"] for result in results),
+    "seconds": time.perf_counter() - start,
+    "files": results,
+  }
+  if args.summary is None:
+    print(json.dumps(summary, indent=2))
+  else:
+    with open(args.summary, "w") as summary_file:
+      json.dump(summary, summary_file, indent=2)
+  return 0 if summary["failed"] == 0 else 1
+
 if __name__=="__main__":
+  if len(sys.argv) > 1:
+    sys.exit(cli())
   main()
@@ -0,0 +1,137 @@
+from PIL import Image
+import numpy as np
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import image_stego
+
+# settings every carrier is encrypted with
+BASE_COLOR = (0xF0, 0xF0, 0xF0)
+DIRECTION_INFO = (True, True, True)
+CHANNELS = (True, True, True)
+
+def make_carrier(megapixels, seed=0):
+  """
+  Generates a synthetic carrier: a base color background with blocks of random
+  colors over roughly a third of it.
+  :param float megapixels: the size of the carrier, in millions of pixels
+  :param int seed: the seed for the random colors
+  :return: the carrier Image
+  """
+  width = max(int(round(np.sqrt(megapixels * 1e6 * 4 / 3))), 1)
+  height = max(int(round(megapixels * 1e6 / width)), 1)
+  rng = np.random.default_rng(seed)
+  pixels = np.empty((height, width, 3), dtype=np.uint8)
+  pixels[...] = BASE_COLOR
+
+  # random colors in 8x8 blocks, so the image has both flat and busy regions
+  blocks = rng.random((-(-height // 8), -(-width // 8))) < 0.35
+  noise = np.repeat(np.repeat(blocks, 8, axis=0), 8, axis=1)[:height, :width]
+  pixels[noise] = rng.integers(0, 0xE0, (np.count_nonzero(noise), 3), dtype=np.uint8)
+  return Image.fromarray(pixels)
+
+def measure(function, *args, repeat=1):
+  """
+  Times a function and measures the peak memory it allocates.
+  :param function: the function to call
+  :param args: the arguments to call it with
+  :param int repeat: the number of times to time it, keeping the fastest
+  :return: the fastest time in seconds, the peak bytes allocated, and the last result
+  """
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function(*args)
+    best = min(best, time.perf_counter() - start)
+
+  # measured separately, since tracing allocations slows the call down
+  tracemalloc.start()
+  function(*args)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return best, peak, result
+
+def benchmark_carrier(megapixels, payload_size, repeat=1):
+  """
+  Benchmarks every stage on one synthetic carrier and payload.
+  :param float megapixels: the size of the carrier, in millions of pixels
+  :param int payload_size: the size of the payload in bytes, reduced to what the carrier holds
+  :param int repeat: the number of times to time each stage, keeping the fastest
+  :return: list of dicts of the stage, sizes, seconds, throughput and peak memory
+  """
+  image = make_carrier(megapixels)
+  capacity = image_stego.capacity(image, *CHANNELS, color_count=1).get(BASE_COLOR, 0) // 8
+  payload = np.random.default_rng(1).integers(0, 256, min(payload_size, capacity), dtype=np.uint8).tobytes()
+  encrypted = image_stego.encrypt(payload, image, *DIRECTION_INFO, BASE_COLOR, *CHANNELS, False)
+
+  stages = [
+    ("extract_colors", image_stego.extract_colors, (encrypted,)),
+    ("guess_base_color", image_stego.guess_base_color, (encrypted,)),
+    ("guess_direction_info", image_stego.guess_direction_info, (encrypted,)),
+    ("write_binary", image_stego.write_binary, (image, payload, BASE_COLOR, *CHANNELS, False)),
+    ("extract_binary", image_stego.extract_binary, (encrypted, BASE_COLOR, *CHANNELS, False)),
+    ("encrypt", image_stego.encrypt, (payload, image, *DIRECTION_INFO, BASE_COLOR, *CHANNELS, False)),
+    ("decrypt", image_stego.decrypt, (encrypted, *DIRECTION_INFO, BASE_COLOR, *CHANNELS, False)),
+    ("decrypt_auto", image_stego.decrypt_auto, (encrypted,)),
+  ]
+
+  pixels = image.size[0] * image.size[1]
+  results = []
+  for name, function, args in stages:
+    seconds, peak, _ = measure(function, *args, repeat=repeat)
+    results.append({
+      "stage": name,
+      "width": image.size[0],
+      "height": image.size[1],
+      "megapixels": pixels / 1e6,
+      "payload_bytes": len(payload),
+      "seconds": seconds,
+      "megapixels_per_second": pixels / 1e6 / seconds if seconds else None,
+      "payload_megabytes_per_second": len(payload) / 1e6 / seconds if seconds else None,
+      "peak_memory_bytes": peak,
+    })
+  return results
+
+def run(sizes, payload_sizes, repeat=1):
+  """
+  Benchmarks every stage for every carrier and payload size.
+  :param [float] sizes: the carrier sizes, in millions of pixels
+  :param [int] payload_sizes: the payload sizes, in bytes
+  :param int repeat: the number of times to time each stage, keeping the fastest
+  :return: dict of the environment and the list of results
+  """
+  results = []
+  for megapixels in sizes:
+    for payload_size in payload_sizes:
+      results += benchmark_carrier(megapixels, payload_size, repeat)
+  return {
+    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "python": sys.version.split()[0],
+    "numpy": np.__version__,
+    "results": results,
+  }
+
+def main(argv=None):
+  """
+  Runs the benchmarks from the command line and writes the JSON report.
+  :param [str] argv: the arguments, without the program name. Defaults to sys.argv.
+  """
+  parser = argparse.ArgumentParser(description="Benchmark image_stego on synthetic carriers.")
+  parser.add_argument("--sizes", nargs="+", type=float, default=[0.01, 0.1, 1], help="carrier sizes in megapixels, up to 50")
+  parser.add_argument("--payloads", nargs="+", type=int, default=[1024, 65536], help="payload sizes in bytes")
+  parser.add_argument("--repeat", type=int, default=3, help="times to run each stage, keeping the fastest")
+  parser.add_argument("--output", help="file to write the JSON report to, instead of standard output")
+  args = parser.parse_args(argv)
+
+  report = run(args.sizes, args.payloads, args.repeat)
+  if args.output is None:
+    print(json.dumps(report, indent=2))
+  else:
+    with open(args.output, "w") as output_file:
+      json.dump(report, output_file, indent=2)
+
+if __name__=="__main__":
+  main()
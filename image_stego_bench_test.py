@@ -0,0 +1,23 @@
+import unittest
+import image_stego_bench
+
+class TestBench(unittest.TestCase):
+    def test_make_carrier_size(self):
+        image = image_stego_bench.make_carrier(0.012)
+        width, height = image.size
+        self.assertAlmostEqual(width * height / 1e6, 0.012, places=3)
+        self.assertIn(image_stego_bench.BASE_COLOR, [color for _, color in image.getcolors(width * height)])
+
+    def test_run_reports_every_stage(self):
+        report = image_stego_bench.run([0.001], [64])
+        stages = [result["stage"] for result in report["results"]]
+        self.assertEqual(stages, [
+            "extract_colors", "guess_base_color", "guess_direction_info", "write_binary",
+            "extract_binary", "encrypt", "decrypt", "decrypt_auto",
+        ])
+        for result in report["results"]:
+            self.assertEqual(result["payload_bytes"], 64)
+            self.assertGreater(result["peak_memory_bytes"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import time
+
+import image_stego
+
+class StegoService:
+  """
+  Runs image_stego encryption and decryption for asyncio code. The blocking,
+  CPU-bound work runs in an executor, at most concurrency requests at a time.
+  Requests beyond that wait in a queue of bounded size, and callers wait for
+  room in the queue when it is full.
+  """
+
+  def __init__(self, concurrency=4, queue_size=64, executor=None):
+    """
+    :param int concurrency: the most requests worked on at a time
+    :param int queue_size: the most requests waiting to be worked on
+    :param executor: the concurrent.futures executor to run the work in, or None for a
+    process pool of concurrency workers, owned and shut down by the service
+    """
+    self.concurrency = concurrency
+    self.queue_size = queue_size
+    self.executor = executor
+    self.owns_executor = executor is None
+    self.queue = None
+    self.workers = []
+
+    # metrics
+    self.in_progress = 0
+    self.completed = 0
+    self.failed = 0
+    self.total_latency = 0.0
+    self.max_latency = 0.0
+
+  async def start(self):
+    """
+    Starts taking requests. Must be called from the event loop that will make them.
+    """
+    if self.executor is None:
+      self.executor = ProcessPoolExecutor(max_workers=self.concurrency)
+    self.queue = asyncio.Queue(maxsize=self.queue_size)
+    self.workers = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+
+  async def stop(self):
+    """
+    Finishes the queued requests, then stops.
+    """
+    await self.queue.join()
+    for worker in self.workers:
+      worker.cancel()
+    await asyncio.gather(*self.workers, return_exceptions=True)
+    self.workers = []
+    if self.owns_executor:
+      self.executor.shutdown()
+      self.executor = None
+
+  async def __aenter__(self):
+    await self.start()
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.stop()
+
+  async def work(self):
+    """
+    Runs queued requests in the executor, one at a time, until cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+      function, args, future, queued = await self.queue.get()
+      self.in_progress += 1
+      try:
+        result = await loop.run_in_executor(self.executor, function, *args)
+      except Exception as error:
+        self.failed += 1
+        if not future.cancelled():
+          future.set_exception(error)
+      else:
+        self.completed += 1
+        if not future.cancelled():
+          future.set_result(result)
+      finally:
+        self.in_progress -= 1
+        latency = time.perf_counter() - queued
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.queue.task_done()
+
+  async def submit(self, function, *args):
+    """
+    Queues a call, waiting for room in the queue if it is full, and waits for its result.
+    :param function: the picklable function to call in the executor
+    :param args: the arguments to call it with
+    :return: what the function returns
+    """
+    future = asyncio.get_running_loop().create_future()
+    await self.queue.put((function, args, future, time.perf_counter()))
+    return await future
+
+  async def encode(self, bytes, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False):
+    """
+    Encrypts data into an image, see image_stego.encrypt.
+    :return: image with encrypted data
+    """
+    return await self.submit(image_stego.encrypt, bytes, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed)
+
+  async def decode(self, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed=False):
+    """
+    Decrypts data from an image, see image_stego.decrypt.
+    :return: Bytes bytes: decrypted binary data
+    """
+    return await self.submit(image_stego.decrypt, image, horiz_first, top_to_bottom, left_to_right, BASE_COLOR, red, green, blue, reversed, framed)
+
+  async def decode_auto(self, image):
+    """
+    Decrypts data from an image automatically, see image_stego.decrypt_auto.
+    :return: Bytes bytes: decrypted binary data
+    """
+    return await self.submit(image_stego.decrypt_auto, image)
+
+  def metrics(self):
+    """
+    :return: dict of the queue depth, requests in progress, completed and failed
+    requests, and the mean and max latency in seconds from queueing to result
+    """
+    finished = self.completed + self.failed
+    return {
+      "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+      "in_progress": self.in_progress,
+      "completed": self.completed,
+      "failed": self.failed,
+      "mean_latency": self.total_latency / finished if finished else 0.0,
+      "max_latency": self.max_latency,
+    }
@@ -0,0 +1,53 @@
+import unittest
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import image_stego_service
+from PIL import Image
+
+class TestStegoService(unittest.IsolatedAsyncioTestCase):
+    async def test_encode_decode(self):
+        image = Image.new("RGB",(20,20),(0x20,0x30,0x40))
+        async with image_stego_service.StegoService(concurrency=2) as service:
+            encrypted = await service.encode(b'async', image, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True)
+            actual = await service.decode(encrypted, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True)
+            self.assertEqual(actual, b'async')
+            self.assertEqual(await service.decode_auto(encrypted), b'async')
+            self.assertEqual(service.metrics()["completed"], 3)
+
+    async def test_bounded_concurrency_and_backpressure(self):
+        release = threading.Event()
+        running = []
+        def blocking(value):
+            running.append(value)
+            release.wait()
+            return value
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            service = image_stego_service.StegoService(concurrency=2, queue_size=1, executor=executor)
+            await service.start()
+            requests = [asyncio.create_task(service.submit(blocking, value)) for value in range(4)]
+            await asyncio.sleep(0.1)
+
+            # two running, one queued, one waiting for room in the queue
+            metrics = service.metrics()
+            self.assertEqual(len(running), 2)
+            self.assertEqual((metrics["in_progress"], metrics["queue_depth"]), (2, 1))
+            self.assertFalse(any(request.done() for request in requests))
+
+            release.set()
+            self.assertEqual(await asyncio.gather(*requests), [0, 1, 2, 3])
+            await service.stop()
+            self.assertEqual(service.metrics()["completed"], 4)
+            self.assertGreater(service.metrics()["max_latency"], 0)
+
+    async def test_failures_are_raised_to_the_caller(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            async with image_stego_service.StegoService(concurrency=1, executor=executor) as service:
+                image = Image.new("RGB",(4,4))
+                with self.assertRaises(ValueError):
+                    await service.decode(image, True, True, True, (0,0,0), True, True, True, False, framed=True)
+                self.assertEqual(service.metrics()["failed"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
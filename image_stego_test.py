@@ -1,6 +1,13 @@
 import unittest
+import itertools
+import io
+import json
+import os
+import tempfile
+import zlib
 import image_stego
 from PIL import Image
+import numpy as np
 
 def pixilify(image):
   """
@@ -60,6 +67,30 @@ class TestMethods(unittest.TestCase):
         expected = 4
         self.assertEqual(actual, expected)
 
+    def test_color_index_closest_ties(self):
+        color_dict = {
+            (0x10,0x10,0x12) : 1,
+            (0x10,0x12,0x10) : 1,
+            (0x10,0x10,0x10) : 1,
+            (0x80,0x80,0x80) : 1,
+        }
+        index = image_stego.ColorIndex.from_dict(color_dict)
+        self.assertEqual(index.closest((0x10,0x10,0x10)), (0x10,0x12,0x10))
+        self.assertEqual(index.closest((0xFF,0xFF,0xFF)), (0x80,0x80,0x80))
+
+    def test_color_index_close_counts(self):
+        color_dict = {
+            (0x10, 0x10, 0x10) : 1,
+            (0x0F, 0x10, 0x10) : 1,
+            (0x10, 0x11, 0x11) : 1,
+            (0x00, 0x00, 0x00) : 1,
+            (0x11, 0x11, 0x11) : 1,
+        }
+        index = image_stego.ColorIndex.from_dict(color_dict)
+        actual = list(index.close_counts())
+        expected = [3, 2, 3, 0, 2]
+        self.assertEqual(actual, expected)
+
     def test_bit_string_to_bytes_1(self):
         bits = "01110100011001010111001101110100"
         actual = image_stego.bit_string_to_bytes(bits)
@@ -72,12 +103,28 @@ class TestMethods(unittest.TestCase):
         expected = b'test'
         self.assertEqual(actual, expected)
     
+    def test_bit_string_to_bytes_invalid(self):
+        for bits in ["01x00002", "0110 001", "0120", "01é"]:
+            with self.assertRaises(ValueError):
+                image_stego.bit_string_to_bytes(bits)
+
     def test_bytes_to_bit_string_1(self):
         bytes = b'test'
         actual = image_stego.bytes_to_bit_string(bytes)
         expected = "01110100011001010111001101110100"
         self.assertEqual(actual, expected)
 
+    def test_bytes_to_bits_1(self):
+        actual = list(image_stego.bytes_to_bits(b'\xA5\x0F'))
+        expected = [1,0,1,0,0,1,0,1,0,0,0,0,1,1,1,1]
+        self.assertEqual(actual, expected)
+
+    def test_bits_to_bytes_1(self):
+        bits = [0,1,1,1,0,1,0,0,0,1,1]
+        actual = image_stego.bits_to_bytes(bits)
+        expected = b't`'
+        self.assertEqual(actual, expected)
+
     def test_rotate_image1(self):
         black_top_right = Image.open("./images/100x100quarter_black_top_right.png")
         actual = pixilify(image_stego.rotate_image(black_top_right, 90))
@@ -181,6 +228,29 @@ class TestMethods(unittest.TestCase):
         }
         self.assertEqual(actual, expected)
 
+    def test_extract_common_colors_ties(self):
+        color_dict = {
+            (0x01,0x01,0x01) : 1,
+            (0x02,0x02,0x02) : 3,
+            (0x03,0x03,0x03) : 2,
+            (0x04,0x04,0x04) : 3,
+            (0x05,0x05,0x05) : 2,
+        }
+        actual = list(image_stego.extract_common_colors(color_dict, 3).items())
+        expected = [
+            ((0x02,0x02,0x02), 3),
+            ((0x04,0x04,0x04), 3),
+            ((0x03,0x03,0x03), 2),
+        ]
+        self.assertEqual(actual, expected)
+
+    def test_top_colors_ties(self):
+        colors = np.array([0x010101, 0x020202, 0x030303, 0x040404, 0x050505])
+        counts = np.array([1, 3, 2, 3, 2])
+        actual_colors, actual_counts = image_stego.top_colors(colors, counts, 3)
+        self.assertEqual(list(actual_colors), [0x020202, 0x040404, 0x030303])
+        self.assertEqual(list(actual_counts), [3, 3, 2])
+
     def test_extract_colors_50x50white(self):
         image = Image.open("./images/50x50white.png")
         actual = image_stego.extract_colors(image)
@@ -194,6 +264,17 @@ class TestMethods(unittest.TestCase):
                     (0xFF,0xFF,0xFF) : 7500}
         self.assertEqual(actual,expected)
     
+    def test_color_histogram_100x100_quarter_black(self):
+        image = Image.open("./images/100x100quarter_black_top_right.png")
+        colors, counts = image_stego.color_histogram(image)
+        self.assertEqual(list(colors), [0xFFFFFF, 0x000000])
+        self.assertEqual(list(counts), [7500, 2500])
+
+    def test_unpack_color_1(self):
+        actual = image_stego.unpack_color(image_stego.pack_colors((0x12,0x34,0x56)))
+        expected = (0x12,0x34,0x56)
+        self.assertEqual(actual, expected)
+
     def test_write_binary(self):
         image = Image.new("RGB",(4,4))
         image.putdata([
@@ -232,6 +313,23 @@ class TestMethods(unittest.TestCase):
         ]
         self.assertEqual(actual, expected)
 
+    def test_write_binary_3(self):
+        image = Image.new("RGB",(4,2))
+        image.putdata([
+            (0,0,0),(9,9,9),(0,0,0),(0,0,0),
+            (0,0,0),(0,0,0),(9,9,9),(0,0,0),
+        ])
+        actual = pixilify(image_stego.write_binary(image, b'\xB4', (0,0,0), True, False, True, True))
+        # B4 is 1011 0100 is 10 | 11 01 | 00 is written blue then red
+
+        expected = [
+            [(0,0,1),(0,0,0)],
+            [(9,9,9),(0,0,0)],
+            [(1,0,1),(9,9,9)],
+            [(1,0,0),(0,0,0)],
+        ]
+        self.assertEqual(actual, expected)
+
     def test_extract_binary(self):
         # ABCD is 41 42 43 44 is 0100 0001 0100 0010 0100 0011 0100 0100 is 010 000 010 100 | 001 001 000 011 | 010 001 00
         image = Image.new("RGB",(4,4))
@@ -260,6 +358,18 @@ class TestMethods(unittest.TestCase):
         expected = b'ABCD\x00'
         self.assertEqual(actual, expected)
 
+    def test_extract_binary3(self):
+        # B4 is 1011 0100 is 10 | 11 01 | 00 is read blue then red
+        image = Image.new("RGB",(4,2))
+        image.putdata([
+            (0,0,1),(9,9,9),(1,0,1),(1,0,0),
+            (0,0,0),(0,1,0),(9,9,9),(0,1,1),
+        ])
+        actual = image_stego.extract_binary(image, (0,0,0), True, False, True, True)
+
+        expected = b'\xB4\x20'
+        self.assertEqual(actual, expected)
+
     def test_to_direction_1(self):
         image = Image.open("./images/100x100quarter_black_top_left.png")
         direction_info = (False, True, False)
@@ -436,5 +546,497 @@ class TestMethods(unittest.TestCase):
 
         self.assertEqual(actual_left_to_right, expected_left_to_right)
         self.assertEqual(actual_horiz_first, expected_horiz_first)
+
+    def test_image_analysis_reuses_results(self):
+        image = Image.open("./images/100x100quarter_black_top_right.png")
+        analysis = image_stego.ImageAnalysis(image)
+        self.assertIs(analysis.histogram, analysis.histogram)
+        self.assertIs(analysis.color_index(), analysis.color_index())
+        self.assertEqual(analysis.base_color(), image_stego.guess_base_color(image))
+
+    def test_top_heaviness_scores_match_rotations(self):
+        image = Image.new("RGB",(4,3))
+        image.putdata([
+            (0,0,1),(0,0,1),(0,1,0),(1,1,0),
+            (1,0,0),(0,1,0),(0,0,0),(9,9,9),
+            (0,0,0),(0,0,0),(0,0,0),(0,1,0),
+        ])
+        masks = image_stego.data_masks(image, (0,0,0), 2)
+        scores = image_stego.top_heaviness_scores(*masks)
+        for degrees in [0, 90, 180, 270]:
+            rotated = image_stego.rotate_image(image, degrees)
+            self.assertEqual(scores[degrees], image_stego.get_top_heaviness(rotated, (0,0,0), 2))
+            self.assertEqual(image_stego.mirrored_from_masks(*masks, degrees), image_stego.is_mirrored(rotated, (0,0,0), 2))
+
+    def test_direction_view_matches_to_direction(self):
+        image = Image.open("./images/kavyansart.png").convert("RGB")
+        for direction_info in itertools.product([False, True], repeat=3):
+            actual = image_stego.direction_view(np.asarray(image), direction_info)
+            expected = np.asarray(image_stego.to_direction(image, direction_info))
+            self.assertTrue(np.array_equal(actual, expected))
+
+    def test_direction_boxes_match_direction_view(self):
+        pixels = np.arange(5 * 7).reshape(5, 7)
+        for direction_info in itertools.product([False, True], repeat=3):
+            view = image_stego.direction_view(pixels, direction_info)
+            boxes = list(image_stego.direction_boxes((7, 5), direction_info, 2))
+            self.assertEqual(len(boxes), -(-view.shape[0] // 2))
+            for top, (left, upper, right, lower) in zip(range(0, view.shape[0], 2), boxes):
+                strip = image_stego.direction_view(pixels[upper:lower, left:right], direction_info)
+                self.assertTrue(np.array_equal(strip, view[top:top + 2]))
+
+    def test_encrypt_decrypt_all_directions(self):
+        image = Image.new("RGB",(5,3),(0x20,0x30,0x40))
+        image.putpixel((1,1),(0,0,0))
+        for direction_info in itertools.product([False, True], repeat=3):
+            encrypted = image_stego.encrypt(b'Hi', image, *direction_info, (0x20,0x30,0x40), True, False, True, False)
+            self.assertEqual(encrypted.size, image.size)
+            actual = image_stego.decrypt(encrypted, *direction_info, (0x20,0x30,0x40), True, False, True, False)
+            self.assertEqual(actual, b'Hi\x00\x00')
+
+    def test_write_binary_stream_matches_write_binary(self):
+        image = Image.new("RGB",(5,7),(0xAA,0xAA,0xAA))
+        image.putpixel((2,3),(0xFF,0xFF,0xFF))
+        expected = image_stego.write_binary(image, b'stream', (0xAA,0xAA,0xAA), True, True, False, True)
+        for strip_height in [1, 2, 7]:
+            out_file = io.BytesIO()
+            image_stego.write_binary_stream(image, io.BytesIO(b'stream'), out_file, (0xAA,0xAA,0xAA), True, True, False, True, strip_height)
+            actual = Image.open(io.BytesIO(out_file.getvalue()))
+            self.assertEqual(actual.size, expected.size)
+            self.assertEqual(actual.tobytes(), expected.tobytes())
+
+    def test_write_binary_stream_directions(self):
+        image = Image.new("RGB",(6,5),(0xAA,0xAA,0xAA))
+        image.putpixel((2,3),(0xFF,0xFF,0xFF))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "carrier.ppm")
+            image.save(path)
+            gray_path = os.path.join(directory, "gray.pgm")
+            image.convert("L").save(gray_path)
+            for direction_info in itertools.product([True, False], repeat=3):
+                expected = image_stego.write_binary(image, b'way', (0xAA,0xAA,0xAA), True, False, True, False, direction_info)
+                out_file = io.BytesIO()
+                image_stego.write_binary_stream(Image.open(path), io.BytesIO(b'way'), out_file, (0xAA,0xAA,0xAA), True, False, True, False, 2, direction_info)
+                self.assertEqual(Image.open(io.BytesIO(out_file.getvalue())).tobytes(), expected.tobytes())
+
+                gray = Image.open(gray_path)
+                expected = image_stego.write_binary(gray, b'way', (0xAA,0xAA,0xAA), True, False, False, False, direction_info)
+                out_file = io.BytesIO()
+                image_stego.write_binary_stream(gray, io.BytesIO(b'way'), out_file, (0xAA,0xAA,0xAA), True, False, False, False, 2, direction_info)
+                actual = Image.open(io.BytesIO(out_file.getvalue()))
+                self.assertEqual((actual.mode, actual.tobytes()), ("L", expected.tobytes()))
+
+    def test_write_binary_stream_modes(self):
+        image = Image.new("RGBA",(20,12),(0x20,0x30,0x40,0x80))
+        for mode in ["LA", "I;16", "RGBA"]:
+            carrier = image.convert(mode)
+            base = tuple(int(value) for value in image_stego.carrier_pixels(carrier)[0, 0, :3]) * 3
+            expected = image_stego.write_binary(carrier, b'modes', base[:3], True, False, True, False)
+            out_file = io.BytesIO()
+            image_stego.write_binary_stream(carrier, io.BytesIO(b'modes'), out_file, base[:3], True, False, True, False, 5)
+            actual = Image.open(io.BytesIO(out_file.getvalue()))
+            colors = image_stego.color_channels(image_stego.carrier_pixels(expected))
+            self.assertEqual(np.asarray(actual).reshape(-1).tolist(), image_stego.carrier_pixels(expected)[:, :, :colors].reshape(-1).tolist())
+        with self.assertRaises(ValueError):
+            image_stego.write_binary_stream(image.convert("P"), io.BytesIO(b'modes'), io.BytesIO(), (0,0,0), True, False, True, False)
+
+    def test_extract_binary_stream_matches_extract_binary(self):
+        image = image_stego.write_binary(Image.new("RGB",(5,7)), b'stream', (0,0,0), True, False, True, False)
+        expected = image_stego.extract_binary(image, (0,0,0), True, False, True, False)
+        for strip_height in [1, 3, 7]:
+            out_file = io.BytesIO()
+            written = image_stego.extract_binary_stream(image, out_file, (0,0,0), True, False, True, False, strip_height=strip_height)
+            self.assertEqual(out_file.getvalue(), expected)
+            self.assertEqual(written, len(expected))
+
+    def test_extract_binary_stream_reads_unloaded_file(self):
+        image = image_stego.write_binary(Image.new("RGB",(5,7)), b'stream', (0,0,0), True, False, True, False)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "carrier.ppm")
+            image.save(path)
+            unloaded = Image.open(path)
+            out_file = io.BytesIO()
+            image_stego.extract_binary_stream(unloaded, out_file, (0,0,0), True, False, True, False, length=3, strip_height=2)
+            self.assertEqual(out_file.getvalue(), b'str')
+            self.assertTrue(unloaded.tile)
+
+            out_file = io.BytesIO()
+            image_stego.extract_binary_stream(image_stego.map_carrier(path), out_file, (0,0,0), True, False, True, False, length=3)
+            self.assertEqual(out_file.getvalue(), b'str')
+
+    def test_extract_binary_strips_stops_at_length(self):
+        image = image_stego.write_binary(Image.new("RGB",(5,7)), b'stream', (0,0,0), True, True, True, False)
+        strips = image_stego.image_strips(image, 1)
+        chunks = list(image_stego.extract_binary_strips(strips, (0,0,0), True, True, True, False, length=3))
+        self.assertEqual(b''.join(chunks), b'str')
+        self.assertEqual(len(list(strips)), 5)
+
+    def test_unframe_payload_1(self):
+        framed = image_stego.frame_payload(b'test', True, False, True, True)
+        header = image_stego.parse_frame_header(framed)
+        self.assertEqual((header.red, header.green, header.blue, header.reversed, header.length), (True, False, True, True, 4))
+        self.assertEqual(image_stego.unframe_payload(framed + b'\x00\x00'), b'test')
+
+    def test_unframe_payload_corrupt(self):
+        framed = bytearray(image_stego.frame_payload(b'test', True, True, True, False))
+        framed[-1] ^= 1
+        with self.assertRaises(ValueError):
+            image_stego.unframe_payload(framed)
+        with self.assertRaises(ValueError):
+            image_stego.unframe_payload(framed[:-1])
+        with self.assertRaises(ValueError):
+            image_stego.unframe_payload(b'\x00' * 32)
+
+    def test_encrypt_decrypt_framed_all_directions(self):
+        image = Image.new("RGB",(20,16),(0x20,0x30,0x40))
+        for direction_info in itertools.product([False, True], repeat=3):
+            encrypted = image_stego.encrypt(b'framed', image, *direction_info, (0x20,0x30,0x40), True, True, True, False, framed=True)
+            actual = image_stego.decrypt(encrypted, *direction_info, (0x20,0x30,0x40), True, True, True, False, framed=True)
+            self.assertEqual(actual, b'framed')
+
+    def test_decrypt_auto_framed(self):
+        image = Image.new("RGB",(20,20),(0x20,0x30,0x40))
+        encrypted = image_stego.encrypt(b'\xFF' * 40, image, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True)
+        self.assertEqual(image_stego.decrypt_auto(encrypted), b'\xFF' * 40)
+
+    def test_cli_batch_encrypt_decrypt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            images = os.path.join(directory, "images")
+            os.makedirs(images)
+            for name in ["a.png", "b.png"]:
+                Image.new("RGB",(20,20),(0x20,0x30,0x40)).save(os.path.join(images, name))
+            with open(os.path.join(images, "broken.png"), "wb") as file:
+                file.write(b'not an image')
+            data = os.path.join(directory, "data.bin")
+            with open(data, "wb") as file:
+                file.write(b'batch')
+            settings = ["--base-color", "32", "48", "64", "--red", "--blue", "--first", "v", "--framed", "--workers", "2"]
+
+            summary = os.path.join(directory, "encrypt.json")
+            status = image_stego.cli(["encrypt", images, "--data", data, "--output-dir", os.path.join(directory, "encrypted"), "--summary", summary] + settings)
+            self.assertEqual(status, 1)
+            with open(summary) as file:
+                report = json.load(file)
+            self.assertEqual((report["succeeded"], report["failed"]), (2, 1))
+            self.assertIn("broken.png", [os.path.basename(result["path"]) for result in report["files"] if not result["ok"]])
+
+            summary = os.path.join(directory, "decrypt.json")
+            status = image_stego.cli(["decrypt", os.path.join(directory, "encrypted"), "--output-dir", os.path.join(directory, "decrypted"), "--summary", summary] + settings)
+            self.assertEqual(status, 0)
+            for name in ["a.bin", "b.bin"]:
+                with open(os.path.join(directory, "decrypted", name), "rb") as file:
+                    self.assertEqual(file.read(), b'batch')
+
+    def test_cli_duplicate_outputs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, "a", "x.png"), os.path.join(directory, "b", "x.png"), os.path.join(directory, "b", "x.bmp"), os.path.join(directory, "b", "y.png")]
+            for path in paths:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                image_stego.encrypt(b'cli', Image.new("RGB",(20,20),(0x20,0x30,0x40)), True, True, True, (0x20,0x30,0x40), True, True, True, False).save(path)
+            output = os.path.join(directory, "out")
+            summary = os.path.join(directory, "summary.json")
+            status = image_stego.cli(["auto"] + paths + ["--output-dir", output, "--summary", summary, "--workers", "1"])
+            self.assertEqual(status, 1)
+            with open(summary) as file:
+                report = json.load(file)
+            self.assertEqual([result["ok"] for result in report["files"]], [False, False, False, True])
+            self.assertEqual(os.listdir(output), ["y.bin"])
+
+    def test_plausibility_1(self):
+        text = image_stego.plausibility(b'The quick brown fox jumps over the lazy dog.\x00\x00')
+        pattern = image_stego.plausibility(b'\x00( ("* "*( \x00( ("* "*( ')
+        self.assertGreater(text, pattern)
+        self.assertEqual(image_stego.plausibility(b'\x00\x00'), 0)
+        self.assertGreater(image_stego.plausibility(b'\x89PNG\r\n\x1a\n'), 2)
+
+    def test_decrypt_brute_force_1(self):
+        image = Image.new("RGB",(30,20),(0x20,0x30,0x40))
+        encrypted = image_stego.encrypt(b'The quick brown fox jumps over the lazy dog.', image, False, True, False, (0x20,0x30,0x40), False, True, True, True)
+        best = image_stego.decrypt_brute_force(encrypted, workers=2, keep=1)[0]
+        self.assertEqual(best["base_color"], (0x20,0x30,0x40))
+        self.assertEqual(best["direction_info"], (False, True, False))
+        self.assertEqual((best["red"], best["green"], best["blue"], best["reversed"]), (False, True, True, True))
+        self.assertTrue(best["data"].startswith(b'The quick brown fox jumps over the lazy dog.'))
+
+    def test_write_binary_multi_round_trip(self):
+        image = Image.new("RGB",(40,30),(0x20,0x30,0x40))
+        for x in range(40):
+            for y in range(15):
+                image.putpixel((x,y),(0x81,0x80,0x10) if (x + y) % 2 else (0x20,0x30,0x41))
+        base_colors = image_stego.choose_base_colors(image, 2, True, True, True)
+        self.assertEqual(base_colors, [(0x20,0x30,0x40), (0x80,0x80,0x10)])
+        payload = b'more than one color holds' * 15
+        encrypted = image_stego.write_binary_multi(image, payload, base_colors, True, True, True, False, (True, False, True))
+        actual = image_stego.extract_binary(encrypted, (0x20,0x30,0x40), True, True, True, False, (True, False, True), multi=True)
+        self.assertEqual(actual, payload)
+        with self.assertRaises(ValueError):
+            image_stego.extract_binary(encrypted, (0x20,0x30,0x40), True, True, True, False, (True, False, True), multi=True, bits_per_channel=2)
+        with self.assertRaises(ValueError):
+            image_stego.extract_binary(encrypted.convert("RGBA"), (0x20,0x30,0x40), True, True, True, False, (True, False, True), multi=True, alpha=True)
+
+    def test_write_binary_multi_errors(self):
+        image = Image.new("RGB",(4,4),(0x20,0x30,0x40))
+        with self.assertRaises(ValueError):
+            image_stego.write_binary_multi(image, b'', [(0x20,0x30,0x40),(0x21,0x30,0x40)], True, False, False, False)
+        with self.assertRaises(ValueError):
+            image_stego.write_binary_multi(image, b'too much', [(0x20,0x30,0x40)], True, True, True, False)
+        for mode in ["L", "P"]:
+            with self.assertRaisesRegex(ValueError, "RGB"):
+                image_stego.write_binary_multi(Image.new(mode,(40,30)), b'', [(0,0,0)], True, True, True, False)
+            with self.assertRaisesRegex(ValueError, "RGB"):
+                image_stego.extract_binary(Image.new(mode,(40,30)), (0,0,0), True, True, True, False, multi=True)
+        with self.assertRaisesRegex(ValueError, "channel"):
+            image_stego.write_binary_multi(image, b'', [(0x20,0x30,0x40)], False, False, False, False)
+        with self.assertRaisesRegex(ValueError, "channel"):
+            image_stego.extract_binary(image, (0x20,0x30,0x40), False, False, False, False, multi=True)
+
+    def test_capacity_1(self):
+        image = Image.new("RGB",(10,10),(0x20,0x30,0x40))
+        for x in range(10):
+            image.putpixel((x,0),(0xFF,0xFF,0xFF))
+            image.putpixel((x,1),(0x21,0x30,0x40))
+        actual = image_stego.capacity(image, True, False, True)
+        expected = {(0x20,0x30,0x40) : 160, (0x21,0x30,0x40) : 20, (0xFF,0xFF,0xFF) : 20}
+        self.assertEqual(actual, expected)
+        actual = image_stego.capacity(image, True, False, True, color_count=1, cells=True)
+        expected = {(0x20,0x30,0x40) : 180}
+        self.assertEqual(actual, expected)
+
+    def test_capacity_single_channel(self):
+        image = Image.new("L",(10,10),64)
+        image.putpixel((0,0),65)
+        self.assertEqual(image_stego.capacity(image, True, False, True), {(64,64,64) : 99, (65,65,65) : 1})
+        self.assertEqual(image_stego.capacity(image, True, False, True, color_count=1, cells=True), {(64,64,64) : 100})
+        self.assertEqual(image_stego.capacity(image, True, False, True, analysis=image_stego.ImageAnalysis(image)), {(64,64,64) : 99, (65,65,65) : 1})
+        self.assertEqual(image_stego.recommend_base_color(image, 12), {"base_color": (64,64,64), "red": True, "green": False, "blue": False, "bits": 99})
+        self.assertIsNone(image_stego.recommend_base_color(image, 13))
+        palette = Image.new("RGB",(10,10),(0x20,0x30,0x40)).quantize(2)
+        self.assertEqual(image_stego.capacity(palette, True, True, True), {(0,0,0) : 100})
+
+    def test_capacity_reuses_analysis(self):
+        image = Image.open("./images/kavyansart.png").convert("RGB")
+        analysis = image_stego.ImageAnalysis(image)
+        for cells in [False, True]:
+            expected = image_stego.capacity(image, True, False, True, cells=cells)
+            self.assertEqual(list(image_stego.capacity(image, True, False, True, cells=cells, analysis=analysis).items()), list(expected.items()))
+        self.assertEqual(image_stego.recommend_base_color(image, 20, analysis=analysis), image_stego.recommend_base_color(image, 20))
+        self.assertIn("histogram", vars(analysis))
+
+    def test_recommend_base_color_1(self):
+        image = Image.new("RGB",(10,10),(0x20,0x30,0x40))
+        self.assertEqual(image_stego.recommend_base_color(image), {"base_color": (0x20,0x30,0x40), "red": True, "green": True, "blue": True, "bits": 300})
+        self.assertEqual(image_stego.recommend_base_color(image, 20), {"base_color": (0x20,0x30,0x40), "red": True, "green": True, "blue": False, "bits": 200})
+        self.assertIsNone(image_stego.recommend_base_color(image, 38))
+
+    def test_prepared_carrier_matches_encrypt(self):
+        image = Image.open("./images/kavyansart.png")
+        carrier = image_stego.PreparedCarrier(image, False, True, False, (0xFF,0xFF,0xFF), True, False, True, True)
+        for payload in [b'first recipient', b'second', b'']:
+            expected = image_stego.encrypt(payload, image, False, True, False, (0xFF,0xFF,0xFF), True, False, True, True, framed=True)
+            actual = carrier.encrypt(payload, framed=True)
+            self.assertEqual(actual.mode, expected.mode)
+            self.assertEqual(actual.tobytes(), expected.tobytes())
+
+    def test_prepared_carrier_options(self):
+        image = Image.new("RGBA",(12,10),(0x20,0x30,0x40,0x80))
+        for mode in ["RGBA", "LA", "P"]:
+            carrier_image = image.convert(mode)
+            base = tuple(int(value) for value in image_stego.carrier_pixels(carrier_image)[0, 0, :3]) * 3
+            for bits_per_channel in [1, 3]:
+                alpha = mode != "P"
+                carrier = image_stego.PreparedCarrier(carrier_image, True, True, True, base[:3], True, False, True, False, alpha=alpha, bits_per_channel=bits_per_channel)
+                expected = image_stego.encrypt(b'options', carrier_image, True, True, True, base[:3], True, False, True, False, framed=True, alpha=alpha, bits_per_channel=bits_per_channel)
+                actual = carrier.encrypt(b'options', framed=True)
+                self.assertEqual((actual.mode, actual.tobytes(), actual.getpalette()), (expected.mode, expected.tobytes(), expected.getpalette()))
+
+    def test_profile_stages(self):
+        image = image_stego.encrypt(b'profile', Image.new("RGB",(30,20),(0x20,0x30,0x40)), True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True)
+        seen = []
+        with image_stego.profile(seen.append, allocations=True) as timings:
+            self.assertEqual(image_stego.decrypt_auto(image), b'profile')
+        self.assertEqual(timings, seen)
+        self.assertEqual(timings[-1].stage, "decrypt_auto")
+        stages = [timing.stage for timing in timings]
+        for stage in ["color_histogram", "guess_base_color", "top_heaviness_scores", "mirrored_from_masks", "extract_framed"]:
+            self.assertIn(stage, stages)
+        self.assertEqual(timings[-1].pixels, 600)
+        self.assertTrue(all(timing.allocated >= 0 for timing in timings))
+        summary = image_stego.profile_summary(timings)
+        self.assertEqual(summary["decrypt_auto"]["calls"], 1)
+        self.assertGreaterEqual(summary["decrypt_auto"]["allocated"], summary["color_histogram"]["allocated"])
+
+        # nothing is recorded outside of the context
+        image_stego.decrypt_auto(image)
+        self.assertEqual(len(timings), len(seen))
+        self.assertEqual(image_stego.stage_listeners, [])
+
+    def test_cli_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a.png")
+            image_stego.encrypt(b'cli', Image.new("RGB",(20,20),(0x20,0x30,0x40)), True, True, True, (0x20,0x30,0x40), True, True, True, False).save(path)
+            summary = os.path.join(directory, "summary.json")
+            status = image_stego.cli(["auto", path, "--output-dir", directory, "--summary", summary, "--profile", "--workers", "1"])
+            self.assertEqual(status, 0)
+            with open(summary) as file:
+                report = json.load(file)
+            self.assertEqual(report["files"][0]["profile"]["decrypt_auto"]["pixels"], 400)
+
+    def test_map_carrier_formats(self):
+        pixels = np.zeros((5,7,3), dtype=np.uint8)
+        pixels[..., 0] = np.arange(7)
+        pixels[..., 1] = np.arange(5)[:, None]
+        pixels[..., 2] = 9
+        image = Image.fromarray(pixels)
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["a.ppm", "a.bmp"]:
+                image.save(os.path.join(directory, name))
+                self.assertEqual(image_stego.map_carrier(os.path.join(directory, name)).tolist(), pixels.tolist())
+            image.convert("L").save(os.path.join(directory, "a.pgm"))
+            self.assertEqual(image_stego.map_carrier(os.path.join(directory, "a.pgm")).shape, (5,7,1))
+            with open(os.path.join(directory, "a.raw"), "wb") as file:
+                file.write(b'head' + pixels.tobytes())
+            self.assertEqual(image_stego.map_carrier(os.path.join(directory, "a.raw"), shape=(5,7,3), offset=4).tolist(), pixels.tolist())
+            image.save(os.path.join(directory, "a.png"))
+            with self.assertRaises(ValueError):
+                image_stego.map_carrier(os.path.join(directory, "a.png"))
+
+    def test_encrypt_decrypt_mapped(self):
+        image = Image.new("RGB",(31,17),(0x20,0x30,0x40))
+        image.putpixel((3,4),(0x90,0x90,0x90))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "carrier.bmp")
+            out_path = os.path.join(directory, "encrypted.bmp")
+            image.save(path)
+            for direction_info in itertools.product([True, False], repeat=3):
+                image_stego.encrypt_mapped(b'mapped', path, out_path, *direction_info, (0x20,0x30,0x40), True, False, True, True)
+                expected = image_stego.encrypt(b'mapped', image, *direction_info, (0x20,0x30,0x40), True, False, True, True)
+                self.assertEqual(Image.open(out_path).tobytes(), expected.tobytes())
+                self.assertEqual(image_stego.decrypt_mapped(out_path, *direction_info, (0x20,0x30,0x40), True, False, True, True)[:6], b'mapped')
+            self.assertEqual(Image.open(path).tobytes(), image.tobytes())
+
+            # copy on write leaves the file alone, while None writes it in place
+            pixels = image_stego.map_carrier(path, "c")
+            image_stego.write_binary_in_place(pixels, b'\xff', (0x20,0x30,0x40), True, True, True, False)
+            self.assertEqual(pixels[0, 0].tolist(), [0x21,0x31,0x41])
+            self.assertEqual(Image.open(path).tobytes(), image.tobytes())
+
+            # write_binary and encrypt copy a mapped array unless in place
+            pixels = image_stego.map_carrier(path, "c")
+            for direction_info in itertools.product([True, False], repeat=3):
+                expected = image_stego.encrypt(b'array', image, *direction_info, (0x20,0x30,0x40), True, False, True, False, framed=True)
+                encrypted = image_stego.encrypt(b'array', pixels, *direction_info, (0x20,0x30,0x40), True, False, True, False, framed=True)
+                self.assertEqual(encrypted.tobytes(), expected.tobytes())
+                self.assertEqual(image_stego.decrypt(encrypted, *direction_info, (0x20,0x30,0x40), True, False, True, False, framed=True), b'array')
+            self.assertEqual(pixels.tobytes(), image.tobytes())
+            self.assertIs(image_stego.write_binary(pixels, b'\xff', (0x20,0x30,0x40), True, True, True, False, in_place=True), pixels)
+            self.assertEqual(pixels[0, 0].tolist(), [0x21,0x31,0x41])
+            self.assertEqual(image_stego.encrypt_mapped(b'in place', path, None, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True), (len(b'in place') + image_stego.FRAME_HEADER.size) * 8)
+            self.assertEqual(image_stego.decrypt_mapped(path, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True), b'in place')
+
+    def test_write_binary_in_place(self):
+        image = Image.new("RGBA",(6,4),(0x20,0x30,0x40,0x80))
+        image.putpixel((5,0),(0x90,0x90,0x90,0x80))
+        original = image.tobytes()
+
+        copied = image_stego.write_binary(image, b'\xa5', (0x20,0x30,0x40), True, True, True, False)
+        self.assertIsNot(copied, image)
+        self.assertEqual(image.tobytes(), original)
+        self.assertEqual(copied.getpixel((0,0)), (0x21,0x30,0x41,0x80))
+
+        prepared = image_stego.PreparedCarrier(image, True, True, True, (0x20,0x30,0x40), True, True, True, False).encrypt(b'\xa5')
+        self.assertEqual(prepared.tobytes(), copied.tobytes())
+        multi = image_stego.write_binary_multi(Image.new("RGBA",(10,10),(0x20,0x30,0x40,0x80)), b'', [(0x20,0x30,0x40)], True, True, True, False)
+        self.assertEqual(multi.getchannel("A").getextrema(), (0x80,0x80))
+
+        written = image_stego.write_binary(image, b'\xa5', (0x20,0x30,0x40), True, True, True, False, in_place=True)
+        self.assertIs(written, image)
+        self.assertEqual([image.getpixel((x,0)) for x in range(4)], [(0x21,0x30,0x41,0x80),(0x20,0x30,0x41,0x80),(0x20,0x31,0x40,0x80),(0x20,0x30,0x40,0x80)])
+        self.assertEqual(image.getpixel((5,0)), (0x90,0x90,0x90,0x80))
+        self.assertEqual(image_stego.decrypt(image, True, True, True, (0x20,0x30,0x40), True, True, True, False)[:1], b'\xa5')
+
+    def test_encrypt_alpha(self):
+        image = Image.new("RGBA",(20,10),(0x20,0x30,0x40,0x80))
+        encrypted = image_stego.encrypt(b'alpha', image, False, True, True, (0x20,0x30,0x40), True, False, False, False, framed=True, alpha=True)
+        self.assertEqual(image_stego.decrypt(encrypted, False, True, True, (0x20,0x30,0x40), True, False, False, False, framed=True, alpha=True), b'alpha')
+        self.assertEqual(set(np.asarray(encrypted)[:, :, 3].reshape(-1)), {0x80, 0x81})
+        with self.assertRaises(ValueError):
+            image_stego.encrypt(b'alpha', image.convert("RGB"), True, True, True, (0x20,0x30,0x40), True, False, False, False, alpha=True)
+
+    def test_encrypt_image_modes(self):
+        gray = Image.new("L",(20,12),0x40)
+        palette = Image.new("P",(20,12),6)
+        palette.putpalette([value % 256 for value in range(768)])
+        deep = Image.fromarray(np.full((12,20),40000,dtype=np.uint16))
+        for image, BASE_COLOR in [(gray, (0x40,0x40,0x40)), (palette, (6,6,6)), (deep, (40000,0,0))]:
+            encrypted = image_stego.encrypt(b'modes', image, True, True, True, BASE_COLOR, True, True, True, False, framed=True)
+            self.assertEqual(encrypted.mode, image.mode)
+            self.assertEqual(image_stego.decrypt(encrypted, True, True, True, BASE_COLOR, True, False, False, False, framed=True), b'modes')
+            self.assertTrue(np.all(np.abs(np.asarray(encrypted).astype(np.int64) - np.asarray(image)) <= 1))
+        self.assertEqual(encrypted.getpixel((0,0)), 40000)
+        self.assertEqual(image_stego.encrypt(b'', palette, True, True, True, (6,6,6), True, False, False, False).getpalette(), palette.getpalette())
+        self.assertEqual(image_stego.extract_colors(gray), {(0x40,0x40,0x40): 240})
+        with self.assertRaises(ValueError):
+            image_stego.extract_colors(deep)
+
+    def test_encrypt_bits_per_channel(self):
+        image = Image.new("RGB",(8,4),(0x20,0x30,0x40))
+        image.putpixel((7,3),(0x90,0x90,0x90))
+        for bits_per_channel in [2, 3, 4]:
+            encrypted = image_stego.encrypt(b'\xde\xad\xbe\xef' * 5, image, True, False, True, (0x20,0x30,0x40), True, True, True, False, bits_per_channel=bits_per_channel)
+            self.assertEqual(image_stego.decrypt(encrypted, True, False, True, (0x20,0x30,0x40), True, True, True, False, bits_per_channel=bits_per_channel)[:20], b'\xde\xad\xbe\xef' * 5)
+            self.assertEqual(encrypted.getpixel((7,3)), (0x90,0x90,0x90))
+        self.assertEqual(image_stego.encrypt(b'\xb4', image, True, True, True, (0x20,0x30,0x40), True, True, True, False, bits_per_channel=4).getpixel((0,0)), (0x2b,0x34,0x40))
+        self.assertEqual(image_stego.capacity(image, True, False, True, 1, bits_per_channel=3), {(0x20,0x30,0x40): 31 * 2 * 3})
+
+    def test_bits_per_channel_out_of_range(self):
+        image = Image.new("RGB",(8,4),(0x20,0x30,0x40))
+        for bits_per_channel in [0, 5, 8]:
+            with self.assertRaises(ValueError):
+                image_stego.write_binary(image, b'', (0x20,0x30,0x40), True, True, True, False, bits_per_channel=bits_per_channel)
+            with self.assertRaises(ValueError):
+                image_stego.extract_binary(image, (0x20,0x30,0x40), True, True, True, False, bits_per_channel=bits_per_channel)
+            with self.assertRaises(ValueError):
+                image_stego.write_binary_in_place(np.array(image), b'x', (0x20,0x30,0x40), True, True, True, False, bits_per_channel=bits_per_channel)
+            with self.assertRaises(ValueError):
+                image_stego.decrypt(image, True, True, True, (0x20,0x30,0x40), True, True, True, False, framed=True, bits_per_channel=bits_per_channel)
+            with self.assertRaises(ValueError):
+                image_stego.capacity(image, True, True, True, bits_per_channel=bits_per_channel)
+
+    def test_encrypt_compressed(self):
+        image = Image.new("RGB",(40,20),(0x20,0x30,0x40))
+        data = b'compress me ' * 100
+        for compression in ["zlib", "lzma", "bz2"]:
+            framed = image_stego.frame_payload(io.BytesIO(data), True, True, True, False, compression, 1)
+            header = image_stego.parse_frame_header(framed)
+            self.assertEqual((header.version, header.compression), (image_stego.COMPRESSED_FRAME_VERSION, compression))
+            self.assertLess(len(framed), len(data))
+            self.assertEqual(image_stego.unframe_payload(framed), data)
+
+            encrypted = image_stego.encrypt(data, image, False, True, False, (0x20,0x30,0x40), True, True, True, False, compression=compression)
+            self.assertEqual(image_stego.decrypt(encrypted, False, True, False, (0x20,0x30,0x40), True, True, True, False, framed=True), data)
+        self.assertIsNone(image_stego.parse_frame_header(image_stego.frame_payload(data, True, True, True, False)).compression)
+
+        # a stream that ends early is caught even though its checksum matches
+        truncated = bytearray(image_stego.frame_payload(data, True, True, True, False, "zlib"))[:-4]
+        stored = truncated[image_stego.FRAME_HEADER.size:]
+        image_stego.FRAME_HEADER.pack_into(truncated, 0, image_stego.FRAME_MAGIC, image_stego.COMPRESSED_FRAME_VERSION, 0x17, len(stored), zlib.crc32(stored))
+        with self.assertRaises(ValueError):
+            image_stego.unframe_payload(truncated)
+        with self.assertRaises(ValueError):
+            image_stego.encrypt(data, image, True, True, True, (0x20,0x30,0x40), True, True, True, False, compression="zip")
+        for compression, level in [("zlib", 10), ("lzma", 20), ("lzma", -1), ("bz2", 0)]:
+            with self.assertRaises(ValueError):
+                image_stego.frame_payload(data, True, True, True, False, compression, level)
+
+    def test_unframe_payload_decompresses_in_chunks(self):
+        data = bytes(range(256)) * (image_stego.COMPRESSION_CHUNK // 160)
+        for compression in ["zlib", "lzma", "bz2"]:
+            framed = image_stego.frame_payload(data, True, True, True, False, compression, 1)
+            self.assertEqual(image_stego.unframe_payload(framed), data)
+            chunks = [framed[start:start + 1000] for start in range(0, len(framed), 1000)]
+            self.assertEqual(image_stego.read_frame(iter(chunks))[1], data)
+            with self.assertRaises(ValueError):
+                image_stego.unframe_payload(framed, len(data) - 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file